@@ -0,0 +1,232 @@
+import argparse
+import array
+import csv
+import json
+import math
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+import coen266_w2
+import coen266_w3
+
+
+class ExpansionBudgetExceeded(Exception):
+  pass
+
+
+def grid_graph_environment(module, width, seed):
+  rng = random.Random(seed)
+  coords = array.array("d")
+  for row in range(width):
+    for col in range(width):
+      coords.extend([col + rng.uniform(-0.3, 0.3), row + rng.uniform(-0.3, 0.3)])
+  sources = array.array("i")
+  targets = array.array("i")
+  weights = array.array("d")
+  for node in range(width * width):
+    neighbors = []
+    if node % width < width - 1:
+      neighbors.append(node + 1)
+    if node + width < width * width:
+      neighbors.append(node + width)
+    for neighbor in neighbors:
+      dx = coords[2 * node] - coords[2 * neighbor]
+      dy = coords[2 * node + 1] - coords[2 * neighbor + 1]
+      sources.append(node)
+      targets.append(neighbor)
+      weights.append(math.hypot(dx, dy) * rng.uniform(1, 1.5))
+  # only the week 3 graph takes coordinates, for its straight-line heuristic
+  extra = {"coords": coords} if module is coen266_w3 else {}
+  return module.GraphPathfindingEnvironment.from_edges(
+    width * width, sources, targets, weights, 0, width * width - 1, directed=False, **extra)
+
+
+def environments(module):
+  # (label, factory(seed)) built from the given module's own classes
+  cases = [
+    ("VacuumEnvironment", lambda seed: module.VacuumEnvironment()),
+    ("SmallRomanianPathfindingEnvironment", lambda seed: module.SmallRomanianPathfindingEnvironment()),
+  ]
+  for width in (4, 8):
+    cases.append(("GridVacuumEnvironment(%dx%d)" % (width, width),
+                  lambda seed, width=width: module.GridVacuumEnvironment(width, width, seed=seed)))
+  for size in (4, 6):
+    cases.append(("IncrementalNQueensEnvironment(%d)" % size,
+                  lambda seed, size=size: module.IncrementalNQueensEnvironment(size)))
+  for size in (8, 16, 30):
+    cases.append(("BitboardNQueensEnvironment(%d)" % size,
+                  lambda seed, size=size: module.BitboardNQueensEnvironment(size)))
+  for width in (10, 30):
+    cases.append(("GraphPathfindingEnvironment(grid %dx%d)" % (width, width),
+                  lambda seed, width=width: grid_graph_environment(module, width, seed)))
+  return cases
+
+
+def agents(module):
+  if module is coen266_w2:
+    return [
+      coen266_w2.first_action_agent,
+      coen266_w2.random_agent,
+      coen266_w2.dfs_agent,
+      coen266_w2.bfs_agent,
+      coen266_w2.bfs_early_goal_agent,
+      coen266_w2.ucs_agent,
+    ]
+  return [
+    coen266_w3.greedy_search_agent,
+    coen266_w3.beam_search_agent,
+    coen266_w3.a_star_agent,
+    coen266_w3.ara_star_agent,
+    coen266_w3.external_a_star_agent,
+    coen266_w3.hda_star_agent,
+    coen266_w3.ida_star_agent,
+    coen266_w3.sma_star_agent,
+    coen266_w3.bidirectional_ucs_agent,
+    coen266_w3.bidirectional_a_star_agent,
+  ]
+
+
+MODULES = [coen266_w2, coen266_w3]
+
+
+def supports(env, agent):
+  if agent.__name__.startswith("bidirectional"):
+    return hasattr(env, "goal_state") and hasattr(env, "get_predecessors")
+  return True
+
+
+def limit_expansions(env, max_expansions):
+  # instance attributes shadow the methods, so the classes stay untouched
+  is_goal = env.is_goal
+  record_frontier = env.record_frontier
+
+  def check():
+    if env.nodes_expanded > max_expansions:
+      raise ExpansionBudgetExceeded()
+
+  def limited_is_goal(node):
+    check()
+    return is_goal(node)
+
+  def limited_record_frontier(size):
+    check()
+    record_frontier(size)
+
+  env.is_goal = limited_is_goal
+  env.record_frontier = limited_record_frontier
+
+
+def run_once(module, factory, agent, seed, max_expansions, trace_memory):
+  random.seed(seed)
+  env = factory(seed)
+  limit_expansions(env, max_expansions)
+  root = module.Node(env.init_state(), None, 0, None)
+  if trace_memory:
+    tracemalloc.start()
+  start = time.perf_counter()
+  status = "solved"
+  goal = None
+  try:
+    goal = agent(root, env)
+    if goal is None:
+      status = "failed"
+  except ExpansionBudgetExceeded:
+    status = "budget"
+  except Exception as error:
+    # e.g. first_action_agent and random_agent hit dead ends with no successors
+    status = "error: " + type(error).__name__
+  wall_time = time.perf_counter() - start
+  peak_memory = None
+  if trace_memory:
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+  cost = None
+  if goal is not None:
+    cost = 0
+    while goal.parent:
+      cost += goal.cost
+      goal = goal.parent
+  return {
+    "status": status,
+    "wall_time": wall_time,
+    "nodes_expanded": env.nodes_expanded,
+    "peak_frontier": env.peak_frontier,
+    "peak_memory": peak_memory,
+    "path_cost": cost,
+  }
+
+
+def run_benchmarks(repeats=3, seed=0, max_expansions=200000, env_filter=None, agent_filter=None):
+  results = []
+  for module in MODULES:
+    for (env_label, factory) in environments(module):
+      if env_filter and env_filter not in env_label:
+        continue
+      for agent in agents(module):
+        if agent_filter and agent_filter not in agent.__name__:
+          continue
+        record = {"module": module.__name__, "environment": env_label, "agent": agent.__name__,
+                  "repeats": repeats, "seed": seed}
+        if not supports(factory(seed), agent):
+          record["status"] = "unsupported"
+          results.append(record)
+          continue
+        runs = [run_once(module, factory, agent, seed, max_expansions, False) for _ in range(repeats)]
+        memory_run = run_once(module, factory, agent, seed, max_expansions, True)
+        wall_times = [run["wall_time"] for run in runs]
+        record.update(
+          status=runs[0]["status"],
+          wall_time_median=statistics.median(wall_times),
+          wall_time_min=min(wall_times),
+          nodes_expanded=runs[0]["nodes_expanded"],
+          peak_frontier=runs[0]["peak_frontier"],
+          peak_memory=memory_run["peak_memory"],
+          path_cost=runs[0]["path_cost"],
+        )
+        results.append(record)
+        print("%-11s %-42s %-28s %-11s %10s exp %9.4fs" % (
+          module.__name__, env_label, agent.__name__, record["status"], record["nodes_expanded"], record["wall_time_median"]))
+  return results
+
+
+FIELDS = ["module", "environment", "agent", "status", "repeats", "seed", "wall_time_median", "wall_time_min",
+          "nodes_expanded", "peak_frontier", "peak_memory", "path_cost"]
+
+
+def write_json(path, results, settings):
+  metadata = dict(settings, python=platform.python_version(), platform=platform.platform())
+  with open(path, "w") as json_file:
+    json.dump({"metadata": metadata, "results": results}, json_file, indent=2)
+
+
+def write_csv(path, results):
+  with open(path, "w", newline="") as csv_file:
+    writer = csv.DictWriter(csv_file, fieldnames=FIELDS)
+    writer.writeheader()
+    for record in results:
+      writer.writerow(record)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Sweep every environment against every search agent.")
+  parser.add_argument("--repeats", type=int, default=3)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--max-expansions", type=int, default=200000)
+  parser.add_argument("--env", help="only environments whose label contains this text")
+  parser.add_argument("--agent", help="only agents whose name contains this text")
+  parser.add_argument("--json", help="write results to this JSON file")
+  parser.add_argument("--csv", help="write results to this CSV file")
+  args = parser.parse_args()
+  results = run_benchmarks(args.repeats, args.seed, args.max_expansions, args.env, args.agent)
+  settings = {"repeats": args.repeats, "seed": args.seed, "max_expansions": args.max_expansions}
+  if args.json:
+    write_json(args.json, results, settings)
+  if args.csv:
+    write_csv(args.csv, results)
+
+
+if __name__ == "__main__":
+  main()
@@ -1,10 +1,15 @@
+import array
 import collections
-import copy
-import heapq
+import csv
+import json
+import math
 import random
+import time
 
 
 class Node:
+  __slots__ = ("state", "action", "cost", "parent")
+
   def __init__(self, state, action, cost, parent):
     self.state = state
     self.action = action
@@ -14,6 +19,15 @@ class Node:
   def __lt__(self, other):
         return (self.cost < other.cost)
 
+  def full_path(self):
+    path = []
+    node = self
+    while node.parent:
+      path.append(node)
+      node = node.parent
+    path.reverse()
+    return path
+
 
 def get_action_history(node):
   history = []
@@ -24,45 +38,284 @@ def get_action_history(node):
   return history
 
 
+def state_key(state):
+  if isinstance(state, dict):
+    return tuple(sorted((key, state_key(value)) for (key, value) in state.items()))
+  if isinstance(state, list):
+    return tuple(state_key(item) for item in state)
+  if isinstance(state, set):
+    return frozenset(state_key(item) for item in state)
+  return state
+
+
+class IndexedHeap:
+  def __init__(self):
+    self.entries = []
+    self.positions = {}
+    self.counter = 0
+    self.pushes = 0
+    self.decreases = 0
+    self.rejected = 0
+    self.pops = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, key):
+    return key in self.positions
+
+  def push(self, key, priority, item):
+    position = self.positions.get(key)
+    if position is not None and priority >= self.entries[position][0]:
+      self.rejected += 1
+      return False
+    self.counter += 1
+    entry = (priority, self.counter, key, item)
+    if position is None:
+      self.pushes += 1
+      position = len(self.entries)
+      self.entries.append(entry)
+    else:
+      self.decreases += 1
+      self.entries[position] = entry
+    self.sift_up(position)
+    return True
+
+  def pop(self):
+    entries = self.entries
+    top = entries[0]
+    last = entries.pop()
+    del self.positions[top[2]]
+    if entries:
+      entries[0] = last
+      self.sift_down(0)
+    self.pops += 1
+    return (top[2], top[0], top[3])
+
+  def top_priority(self):
+    return self.entries[0][0] if self.entries else math.inf
+
+  def sift_up(self, position):
+    entries = self.entries
+    entry = entries[position]
+    while position > 0:
+      parent = (position - 1) >> 1
+      if not entry < entries[parent]:
+        break
+      entries[position] = entries[parent]
+      self.positions[entries[position][2]] = position
+      position = parent
+    entries[position] = entry
+    self.positions[entry[2]] = position
+
+  def sift_down(self, position):
+    entries = self.entries
+    size = len(entries)
+    entry = entries[position]
+    while True:
+      child = 2 * position + 1
+      if child >= size:
+        break
+      if child + 1 < size and entries[child + 1] < entries[child]:
+        child += 1
+      if not entries[child] < entry:
+        break
+      entries[position] = entries[child]
+      self.positions[entries[position][2]] = position
+      position = child
+    entries[position] = entry
+    self.positions[entry[2]] = position
+
+  def stats(self):
+    return {
+      "pushes": self.pushes,
+      "pops": self.pops,
+      "decrease_keys": self.decreases,
+      "rejected": self.rejected,
+    }
+
+
+class SearchInstrumentation:
+  def __init__(self, sample_every=None, stream=None):
+    # with sample_every set, a JSON summary line is written to stream every
+    # sample_every goal tests; summary() gives the end-of-run totals
+    self.sample_every = sample_every
+    self.stream = stream
+    self.started = None
+    self.goal_tests = 0
+    self.goal_time = 0.0
+    self.successors_generated = 0
+    self.successor_time = 0.0
+    self.duplicate_hits = 0
+    self.frontier_histogram = collections.Counter()
+
+  def attach(self, env):
+    clock = time.perf_counter
+    is_goal = env.is_goal
+    iter_successors = env.iter_successors
+    record_frontier = env.record_frontier
+    record_duplicate = env.record_duplicate
+    self.started = clock()
+
+    def timed_is_goal(node):
+      start = clock()
+      result = is_goal(node)
+      self.goal_time += clock() - start
+      self.goal_tests += 1
+      if self.sample_every and self.goal_tests % self.sample_every == 0:
+        self.export()
+      return result
+
+    def timed_iter_successors(node):
+      successors = iter_successors(node)
+      while True:
+        start = clock()
+        child = next(successors, None)
+        self.successor_time += clock() - start
+        if child is None:
+          return
+        self.successors_generated += 1
+        yield child
+
+    def observed_record_frontier(size):
+      self.frontier_histogram[size.bit_length()] += 1
+      record_frontier(size)
+
+    def counted_record_duplicate():
+      self.duplicate_hits += 1
+      record_duplicate()
+
+    env.is_goal = timed_is_goal
+    env.iter_successors = timed_iter_successors
+    env.record_frontier = observed_record_frontier
+    env.record_duplicate = counted_record_duplicate
+
+  def summary(self):
+    elapsed = time.perf_counter() - self.started
+    return {
+      "elapsed": elapsed,
+      "goal_tests": self.goal_tests,
+      "goal_test_time": self.goal_time,
+      "successors_generated": self.successors_generated,
+      "successor_time": self.successor_time,
+      "duplicate_hits": self.duplicate_hits,
+      "duplicate_rate": self.duplicate_hits / self.successors_generated if self.successors_generated else 0.0,
+      # bucket b counts frontier sizes in [2 ** (b - 1), 2 ** b)
+      "frontier_histogram": dict(sorted(self.frontier_histogram.items())),
+      "expansions_per_second": self.goal_tests / elapsed if elapsed > 0 else 0.0,
+    }
+
+  def export(self):
+    if self.stream is not None:
+      self.stream.write(json.dumps(self.summary()) + "\n")
+
+
 class Environment:
   def __init__(self):
     self.nodes_expanded = 0
+    self.peak_frontier = 0
 
   def is_goal(self, node):
     self.nodes_expanded += 1
     return self.goal_test(node.state)
 
-  def get_successors(self, node):
+  def record_frontier(self, size):
+    if size > self.peak_frontier:
+      self.peak_frontier = size
+
+  def record_duplicate(self):
+    # agents call this whenever they drop a child already reached at least as cheaply
+    pass
+
+  def instrument(self, instrumentation):
+    instrumentation.attach(self)
+    return instrumentation
+
+  def uninstrument(self):
+    for name in ("is_goal", "iter_successors", "record_frontier", "record_duplicate"):
+      self.__dict__.pop(name, None)
+
+  def iter_successors(self, node):
     state = node.state
-    return [
-      Node(self.successor(state, action), action, cost, node)
-      for (action, cost) in self.get_actions(state)
-    ]
+    for (action, cost) in self.get_actions(state):
+      yield Node(self.successor(state, action), action, cost, node)
+
+  def get_successors(self, node):
+    return list(self.iter_successors(node))
+
+
+VacuumState = collections.namedtuple("VacuumState", ["agent_loc", "tiles"])
 
 
 class VacuumEnvironment(Environment):
   def init_state(self):
-    return {"agent_loc": 0, "tiles": ["dirty"] * 5}
+    return VacuumState(0, ("dirty",) * 5)
 
   def goal_test(self, state):
-    for tile in state["tiles"]:
-      if tile != "clean":
-        return False
-    return True
+    return "dirty" not in state.tiles
 
   def get_actions(self, state):
     return [("left", 1), ("right", 1), ("suck", 1)]
 
   def successor(self, state, action):
-    next_state = copy.deepcopy(state)
-    agent_loc = state["agent_loc"]
-    if agent_loc < len(state["tiles"]) - 1 and action == "right":
-      next_state["agent_loc"] += 1
+    (agent_loc, tiles) = state
+    if agent_loc < len(tiles) - 1 and action == "right":
+      return VacuumState(agent_loc + 1, tiles)
     elif agent_loc > 0 and action == "left":
-      next_state["agent_loc"] -= 1
-    elif state["tiles"][agent_loc] == "dirty" and action == "suck":
-      next_state["tiles"][agent_loc] = "clean"
-    return next_state
+      return VacuumState(agent_loc - 1, tiles)
+    elif tiles[agent_loc] == "dirty" and action == "suck":
+      return VacuumState(agent_loc, tiles[:agent_loc] + ("clean",) + tiles[agent_loc + 1:])
+    return state
+
+
+GridVacuumState = collections.namedtuple("GridVacuumState", ["agent_loc", "dirt"])
+
+
+class GridVacuumEnvironment(Environment):
+  # tile i sits at (i % width, i // width); bit i of dirt is set while it is dirty
+  def __init__(self, width=5, height=5, dirt_probability=0.5, seed=None, agent_loc=0):
+    super().__init__()
+    self.width = width
+    self.height = height
+    self.agent_loc = agent_loc
+    rng = random.Random(seed)
+    self.dirt = 0
+    for tile in range(width * height):
+      if rng.random() < dirt_probability:
+        self.dirt |= 1 << tile
+
+  def init_state(self):
+    return GridVacuumState(self.agent_loc, self.dirt)
+
+  def goal_test(self, state):
+    return state.dirt == 0
+
+  def get_actions(self, state):
+    (agent_loc, dirt) = state
+    actions = []
+    if dirt >> agent_loc & 1:
+      actions.append(("suck", 1))
+    if agent_loc % self.width > 0:
+      actions.append(("left", 1))
+    if agent_loc % self.width < self.width - 1:
+      actions.append(("right", 1))
+    if agent_loc >= self.width:
+      actions.append(("up", 1))
+    if agent_loc < self.width * (self.height - 1):
+      actions.append(("down", 1))
+    return actions
+
+  def successor(self, state, action):
+    (agent_loc, dirt) = state
+    if action == "suck":
+      return GridVacuumState(agent_loc, dirt & ~(1 << agent_loc))
+    elif action == "left":
+      return GridVacuumState(agent_loc - 1, dirt)
+    elif action == "right":
+      return GridVacuumState(agent_loc + 1, dirt)
+    elif action == "up":
+      return GridVacuumState(agent_loc - self.width, dirt)
+    return GridVacuumState(agent_loc + self.width, dirt)
 
 
 class SmallRomanianPathfindingEnvironment(Environment):
@@ -93,6 +346,10 @@ class SmallRomanianPathfindingEnvironment(Environment):
 
 
 class IncrementalNQueensEnvironment(Environment):
+  def __init__(self, size=6):
+    super().__init__()
+    self.size = size
+
   def locs_diagonal(_, loc1, loc2):
     row_diff = abs(loc1[0] - loc2[0])
     col_diff = abs(loc1[1] - loc2[1])
@@ -108,8 +365,7 @@ class IncrementalNQueensEnvironment(Environment):
     return printable_state
 
   def init_state(self):
-    self.size = 6
-    return []
+    return ()
 
   def goal_test(self, state):
     if len(state) != self.size:
@@ -130,9 +386,154 @@ class IncrementalNQueensEnvironment(Environment):
     return []
 
   def successor(self, state, action):
-    next_state = copy.deepcopy(state)
-    next_state.append(action)
-    return next_state
+    return state + (action,)
+
+
+NQueensState = collections.namedtuple("NQueensState", ["row", "cols", "left_diagonals", "right_diagonals"])
+
+
+class BitboardNQueensEnvironment(Environment):
+  # children are ordered so the most constrained one is explored first: last
+  # for the stack-based week 2 agents, first for agents that break ties in
+  # generation order
+  most_constrained_last = True
+
+  def __init__(self, size=8):
+    super().__init__()
+    self.size = size
+    self.full_mask = (1 << size) - 1
+
+  def init_state(self):
+    return NQueensState(0, 0, 0, 0)
+
+  def goal_test(self, state):
+    return state.row == self.size
+
+  def get_actions(self, state):
+    (row, cols, left, right) = state
+    free = ~(cols | left | right) & self.full_mask
+    actions = []
+    while free:
+      bit = free & -free
+      free ^= bit
+      next_free = ~((cols | bit) | ((left | bit) << 1) | ((right | bit) >> 1)) & self.full_mask
+      if row + 1 < self.size and not next_free:
+        continue
+      actions.append((bin(next_free).count("1"), (row, bit.bit_length() - 1)))
+    actions.sort(reverse=self.most_constrained_last)
+    return [(action, 1) for (_, action) in actions]
+
+  def successor(self, state, action):
+    (row, cols, left, right) = state
+    bit = 1 << action[1]
+    return NQueensState(row + 1, cols | bit, ((left | bit) << 1) & self.full_mask, (right | bit) >> 1)
+
+
+def build_csr(num_nodes, sources, targets, weights):
+  offsets = array.array("q", bytes(8 * (num_nodes + 1)))
+  for source in sources:
+    offsets[source + 1] += 1
+  for node in range(num_nodes):
+    offsets[node + 1] += offsets[node]
+  next_slot = array.array("q", offsets[:num_nodes])
+  csr_targets = array.array("i", bytes(4 * len(targets)))
+  csr_weights = array.array("d", bytes(8 * len(weights)))
+  for (source, target, weight) in zip(sources, targets, weights):
+    slot = next_slot[source]
+    csr_targets[slot] = target
+    csr_weights[slot] = weight
+    next_slot[source] = slot + 1
+  return offsets, csr_targets, csr_weights
+
+
+class GraphPathfindingEnvironment(Environment):
+  def __init__(self, offsets, targets, weights, start, goal, names=None):
+    super().__init__()
+    self.offsets = offsets
+    self.targets = memoryview(targets)
+    self.weights = memoryview(weights)
+    self.start = start
+    self.goal = goal
+    self.names = names
+
+  @classmethod
+  def from_edges(cls, num_nodes, sources, targets, weights, start, goal, directed=True, **kwargs):
+    if not directed:
+      (sources, targets) = (sources + targets, targets + sources)
+      weights = weights + weights
+    (offsets, csr_targets, csr_weights) = build_csr(num_nodes, sources, targets, weights)
+    return cls(offsets, csr_targets, csr_weights, start, goal, **kwargs)
+
+  @classmethod
+  def from_csv(cls, path, start, goal, directed=False, **kwargs):
+    index = {}
+    names = []
+    sources = array.array("i")
+    targets = array.array("i")
+    weights = array.array("d")
+    with open(path, newline="") as edge_file:
+      reader = csv.reader(edge_file)
+      first_row = True
+      for row in reader:
+        if not row or row[0].startswith("#"):
+          continue
+        if len(row) < 3:
+          raise ValueError("%s, line %d: expected source,target,weight, got %r" % (path, reader.line_num, row))
+        try:
+          weight = float(row[2])
+        except ValueError:
+          if first_row:
+            first_row = False
+            continue # header row
+          raise ValueError("%s, line %d: bad edge weight %r" % (path, reader.line_num, row[2])) from None
+        first_row = False
+        for label in row[:2]:
+          if label not in index:
+            index[label] = len(names)
+            names.append(label)
+        sources.append(index[row[0]])
+        targets.append(index[row[1]])
+        weights.append(weight)
+    return cls.from_edges(len(names), sources, targets, weights, index[start], index[goal],
+                          directed=directed, names=names, **kwargs)
+
+  @classmethod
+  def from_dimacs(cls, path, start, goal, **kwargs):
+    # DIMACS node ids are 1-based; states are 0-based
+    num_nodes = 0
+    sources = array.array("i")
+    targets = array.array("i")
+    weights = array.array("d")
+    with open(path) as graph_file:
+      for line in graph_file:
+        if line.startswith("a "):
+          (_, source, target, weight) = line.split()
+          sources.append(int(source) - 1)
+          targets.append(int(target) - 1)
+          weights.append(float(weight))
+        elif line.startswith("p "):
+          num_nodes = int(line.split()[2])
+    return cls.from_edges(num_nodes, sources, targets, weights, start - 1, goal - 1, **kwargs)
+
+  def num_nodes(self):
+    return len(self.offsets) - 1
+
+  def label(self, state):
+    return self.names[state] if self.names else state
+
+  def init_state(self):
+    return self.start
+
+  def goal_test(self, state):
+    return state == self.goal
+
+  def get_actions(self, state):
+    begin = self.offsets[state]
+    end = self.offsets[state + 1]
+    return zip(self.targets[begin:end], self.weights[begin:end])
+
+  def successor(self, state, action):
+    return action
 
 
 def first_action_agent(root, env):
@@ -155,44 +556,72 @@ def dfs_agent(root, env):
   stack = [root]
   visited = set()
   while stack:
+    env.record_frontier(len(stack))
     node = stack.pop()
     if env.is_goal(node):
       return node
-    visited.add(str(node.state))
-    successors = env.get_successors(node)
-    for child in successors:
-      if str(child.state) not in visited:
+    visited.add(state_key(node.state))
+    for child in env.iter_successors(node):
+      if state_key(child.state) in visited:
+        env.record_duplicate()
+      else:
         stack.append(child)
   return None
 
 from collections import deque
 
-def bfs_agent(root, env):
+def bfs_agent(root, env, early_goal_test=False):
+  if early_goal_test:
+    return bfs_early_goal_agent(root, env)
   queue = deque([root])
   visited = set()
   while queue:
+    env.record_frontier(len(queue))
     node = queue.popleft()
     if env.is_goal(node):
       return node
-    visited.add(str(node.state))
-    successors = env.get_successors(node)
-    for child in successors:
-      if str(child.state) not in visited:
+    visited.add(state_key(node.state))
+    for child in env.iter_successors(node):
+      if state_key(child.state) in visited:
+        env.record_duplicate()
+      else:
         queue.append(child)
   return None
 
+def bfs_early_goal_agent(root, env):
+  # goal-test children as they are generated instead of when they are popped
+  if env.is_goal(root):
+    return root
+  queue = deque([root])
+  reached = {state_key(root.state)}
+  while queue:
+    env.record_frontier(len(queue))
+    node = queue.popleft()
+    for child in env.iter_successors(node):
+      child_key = state_key(child.state)
+      if child_key in reached:
+        env.record_duplicate()
+        continue
+      if env.is_goal(child):
+        return child
+      reached.add(child_key)
+      queue.append(child)
+  return None
+
 def ucs_agent(root, env):
-  heap = [(0, root)]
+  frontier = IndexedHeap()
+  frontier.push(state_key(root.state), 0, root)
   visited = set()
-  while heap:
-    cost, node = heapq.heappop(heap)
+  while frontier:
+    env.record_frontier(len(frontier))
+    key, cost, node = frontier.pop()
     if env.is_goal(node):
       return node
-    visited.add(str(node.state))
-    successors = env.get_successors(node)
-    for child in successors:
-      if str(child.state) not in visited:
-        heapq.heappush(heap, (cost + child.cost, child))
+    visited.add(key)
+    for child in env.iter_successors(node):
+      child_key = state_key(child.state)
+      if child_key in visited or not frontier.push(child_key, cost + child.cost, child):
+        env.record_duplicate()
   return None
 
 def main():
@@ -1,99 +1,179 @@
+import array
 import collections
-import copy
+import csv
 import heapq
 import math
+import mmap
+import multiprocessing
+import os
+import pickle
+import queue
 import random
+import signal
+import sys
+import tempfile
+import time
+import zlib
 
+import coen266_w2
+from coen266_w2 import IndexedHeap, Node, build_csr, state_key
 
-class Node:
-  def __init__(self, state, action, cost, parent):
-    self.state = state
-    self.action = action
-    self.cost = cost
-    self.parent = parent
 
-  def full_path(self):
-    path = []
-    node = self
-    while node.parent:
-      path.append(node)
-      node = node.parent
-    path.reverse()
-    return path
+class SearchInstrumentation(coen266_w2.SearchInstrumentation):
+  # the week 2 counters plus the time spent in the heuristic
+  def __init__(self, sample_every=None, stream=None):
+    super().__init__(sample_every, stream)
+    self.heuristic_calls = 0
+    self.heuristic_time = 0.0
+
+  def attach(self, env):
+    super().attach(env)
+    clock = time.perf_counter
+    heuristic = env.heuristic
+    heuristic_many = env.heuristic_many
+
+    def timed_heuristic(node):
+      start = clock()
+      value = heuristic(node)
+      self.heuristic_time += clock() - start
+      self.heuristic_calls += 1
+      return value
+
+    def timed_heuristic_many(nodes):
+      start = clock()
+      values = heuristic_many(nodes)
+      self.heuristic_time += clock() - start
+      self.heuristic_calls += len(nodes)
+      return values
+
+    env.heuristic = timed_heuristic
+    env.heuristic_many = timed_heuristic_many
+
+  def summary(self):
+    summary = super().summary()
+    summary.update(heuristic_calls=self.heuristic_calls, heuristic_time=self.heuristic_time)
+    return summary
+
+
+class HeuristicCache:
+  def __init__(self, max_size=100000):
+    self.max_size = max_size
+    self.values = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self.values)
 
+  def attach(self, env):
+    evaluate = env.evaluate
+    values = self.values
+    # what detach puts back: the instance override (e.g. pattern databases) or
+    # None for the class method, plus any cache this one is stacked on
+    self.wrapped = env.__dict__.get("evaluate")
+    self.previous_cache = env.heuristic_cache
 
-class Environment:
+    def cached_evaluate(state):
+      key = state_key(state)
+      if key in values:
+        self.hits += 1
+        values.move_to_end(key)
+        return values[key]
+      self.misses += 1
+      value = evaluate(state)
+      values[key] = value
+      if len(values) > self.max_size:
+        values.popitem(last=False)
+      return value
+
+    self.cached_evaluate = env.evaluate = cached_evaluate
+    env.heuristic_cache = self
+
+  def detach(self, env):
+    if env.__dict__.get("evaluate") is not self.cached_evaluate:
+      raise ValueError("evaluate was wrapped again after the heuristic cache was attached")
+    if self.wrapped is None:
+      del env.evaluate
+    else:
+      env.evaluate = self.wrapped
+    env.heuristic_cache = self.previous_cache
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      "size": len(self.values),
+      "hits": self.hits,
+      "misses": self.misses,
+      "hit_rate": self.hits / lookups if lookups else 0.0,
+    }
+
+
+class Environment(coen266_w2.Environment):
   def __init__(self):
-    self.nodes_expanded = 0
+    super().__init__()
+    self.heuristic_cache = None
 
-  def is_goal(self, node):
-    self.nodes_expanded += 1
-    return self.goal_test(node.state)
+  def cache_heuristic(self, max_size=100000):
+    cache = HeuristicCache(max_size)
+    cache.attach(self)
+    return cache
 
-  def get_successors(self, node):
-    state = node.state
-    return [
-      Node(self.successor(state, action), action, cost, node)
-      for (action, cost) in self.get_actions(state)
-    ]
+  def use_pattern_databases(self, databases, additive=False):
+    # the combined value never drops below the environment's own estimate
+    databases = list(databases)
+    if additive:
+      # a sum stays admissible only if no two abstractions charge for the same action
+      tiles = [tile for database in databases for tile in database.abstraction.pattern]
+      if len(tiles) != len(set(tiles)):
+        raise ValueError("additive pattern databases need disjoint patterns")
+      if sum(database.abstraction.count_moves for database in databases) > 1:
+        raise ValueError("at most one additive pattern database may count moves")
+    evaluate = self.evaluate
+    combine = sum if additive else max
+
+    def pattern_evaluate(state):
+      return max(evaluate(state), combine(database.lookup(state) for database in databases))
+
+    self.evaluate = pattern_evaluate
+
+  def uncache_heuristic(self):
+    if self.heuristic_cache is not None:
+      self.heuristic_cache.detach(self)
+
+  def uninstrument(self):
+    super().uninstrument()
+    for name in ("heuristic", "heuristic_many"):
+      self.__dict__.pop(name, None)
 
   def heuristic(self, node):
     return self.evaluate(node.state)
 
+  def heuristic_many(self, nodes):
+    return [self.evaluate(node.state) for node in nodes]
 
-class VacuumEnvironment(Environment):
-  def init_state(self):
-    return {"agent_loc": 0, "tiles": ["dirty"] * 5}
-
-  def goal_test(self, state):
-    for tile in state["tiles"]:
-      if tile != "clean":
-        return False
-    return True
 
-  def get_actions(self, state):
-    return [("left", 1), ("right", 1), ("suck", 1)]
+class VacuumEnvironment(coen266_w2.VacuumEnvironment, Environment):
+  def evaluate(self, state):
+    return state.tiles.count("dirty")
 
-  def successor(self, state, action):
-    next_state = copy.deepcopy(state)
-    agent_loc = state["agent_loc"]
-    if agent_loc < len(state["tiles"]) - 1 and action == "right":
-      next_state["agent_loc"] += 1
-    elif agent_loc > 0 and action == "left":
-      next_state["agent_loc"] -= 1
-    elif state["tiles"][agent_loc] == "dirty" and action == "suck":
-      next_state["tiles"][agent_loc] = "clean"
-    return next_state
 
+class GridVacuumEnvironment(coen266_w2.GridVacuumEnvironment, Environment):
   def evaluate(self, state):
-    return sum([(1 if tile == "dirty" else 0) for tile in state["tiles"]])
-
-
-class SmallRomanianPathfindingEnvironment(Environment):
-  def init_state(self):
-    return "Sibiu"
-
-  def goal_test(self, state):
-    return state == "Bucharest"
-
-  def get_actions(self, state):
-    if state == "Sibiu":
-      return [("Fagaras", 99), ("Rimnicu Vilcea", 80), ("Atlantis", 1)]
-    elif state == "Fagaras":
-      return [("Sibiu", 99), ("Bucharest", 211)]
-    elif state == "Rimnicu Vilcea":
-      return [("Sibiu", 80), ("Pitesti", 97)]
-    elif state == "Pitesti":
-      return [("Rimnicu Vilcea", 97), ("Bucharest", 101)]
-    elif state == "Bucharest":
-      return [("Fagaras", 211), ("Pitesti", 101)]
-    elif state == "Atlantis":
-      return [("Bucharest", 10000)]
-    else:
-      return []
+    # one suck per dirty tile
+    return bin(state.dirt).count("1")
+
+
+class SmallRomanianPathfindingEnvironment(coen266_w2.SmallRomanianPathfindingEnvironment, Environment):
+  def goal_state(self):
+    return "Bucharest"
 
-  def successor(self, state, action):
-    return action
+  def get_predecessors(self, state):
+    return [
+      (other, action, cost)
+      for other in ["Sibiu", "Fagaras", "Rimnicu Vilcea", "Pitesti", "Bucharest", "Atlantis"]
+      for (action, cost) in self.get_actions(other)
+      if action == state
+    ]
 
   def evaluate(self, state):
     return {
@@ -106,48 +186,7 @@ class SmallRomanianPathfindingEnvironment(Environment):
     }[state]
 
 
-class IncrementalNQueensEnvironment(Environment):
-  def locs_diagonal(_, loc1, loc2):
-    row_diff = abs(loc1[0] - loc2[0])
-    col_diff = abs(loc1[1] - loc2[1])
-    return row_diff == col_diff
-
-  def visualize(self, state):
-    printable_state = ""
-    for row in range(0, self.size):
-      for col in range(0, self.size):
-        printable_cell = "Q" if (row, col) in state else "."
-        printable_state += printable_cell
-      printable_state += "\n"
-    return printable_state
-
-  def init_state(self):
-    self.size = 6
-    return []
-
-  def goal_test(self, state):
-    if len(state) != self.size:
-      return False
-    for piece_loc in state:
-      (x, y) = piece_loc
-      for other_loc in state:
-        if other_loc == piece_loc:
-          continue
-        if other_loc[0] == x or other_loc[1] == y or self.locs_diagonal(piece_loc, other_loc):
-          return False
-    return True
-
-  def get_actions(self, state):
-    if len(state) < self.size:
-      row = len(state)
-      return [((row, col), 1) for col in range (0, self.size)]
-    return []
-
-  def successor(self, state, action):
-    next_state = copy.deepcopy(state)
-    next_state.append(action)
-    return next_state
-
+class IncrementalNQueensEnvironment(coen266_w2.IncrementalNQueensEnvironment, Environment):
   def evaluate(self, state):
     occupied_rows = set()
     occupied_cols = set()
@@ -162,6 +201,321 @@ class IncrementalNQueensEnvironment(Environment):
     return conflicts
 
 
+class BitboardNQueensEnvironment(coen266_w2.BitboardNQueensEnvironment, Environment):
+  most_constrained_last = False
+
+  def evaluate(self, state):
+    return self.size - state.row
+
+
+class GraphPathfindingEnvironment(coen266_w2.GraphPathfindingEnvironment, Environment):
+  def __init__(self, offsets, targets, weights, start, goal, names=None, coords=None, coord_scale=1.0):
+    super().__init__(offsets, targets, weights, start, goal, names)
+    self.coords = coords
+    self.coord_scale = coord_scale
+    self.reverse_offsets = None
+    self.landmarks = None
+
+  @classmethod
+  def from_csv(cls, path, start, goal, directed=False, coords_path=None, coord_scale=1.0):
+    graph = super().from_csv(path, start, goal, directed, coord_scale=coord_scale)
+    if coords_path:
+      index = {name: node for (node, name) in enumerate(graph.names)}
+      # nodes left out of the coordinates file stay NaN and get no estimate
+      coords = array.array("d", [math.nan]) * (2 * len(index))
+      with open(coords_path, newline="") as coords_file:
+        for row in csv.reader(coords_file):
+          if row and row[0] in index:
+            node = index[row[0]]
+            coords[2 * node] = float(row[1])
+            coords[2 * node + 1] = float(row[2])
+      graph.coords = coords
+    return graph
+
+  @classmethod
+  def from_dimacs(cls, path, start, goal, coords_path=None, coord_scale=1.0):
+    graph = super().from_dimacs(path, start, goal, coord_scale=coord_scale)
+    if coords_path:
+      coords = array.array("d", [math.nan]) * (2 * graph.num_nodes())
+      with open(coords_path) as coords_file:
+        for line in coords_file:
+          if line.startswith("v "):
+            (_, node, x, y) = line.split()
+            coords[2 * (int(node) - 1)] = float(x)
+            coords[2 * (int(node) - 1) + 1] = float(y)
+      graph.coords = coords
+    return graph
+
+  def goal_state(self):
+    return self.goal
+
+  def build_reverse(self):
+    if self.reverse_offsets is None:
+      sources = array.array("i")
+      for node in range(self.num_nodes()):
+        sources.extend([node] * (self.offsets[node + 1] - self.offsets[node]))
+      (self.reverse_offsets, reverse_sources, reverse_weights) = build_csr(
+        self.num_nodes(), self.targets, sources, self.weights)
+      self.reverse_sources = memoryview(reverse_sources)
+      self.reverse_weights = memoryview(reverse_weights)
+
+  def use_landmarks(self, landmarks):
+    if landmarks.num_nodes != self.num_nodes():
+      raise ValueError("landmark table covers %d nodes, the graph has %d" % (landmarks.num_nodes, self.num_nodes()))
+    self.landmarks = landmarks
+
+  def get_predecessors(self, state):
+    self.build_reverse()
+    begin = self.reverse_offsets[state]
+    end = self.reverse_offsets[state + 1]
+    return [
+      (source, state, cost)
+      for (source, cost) in zip(self.reverse_sources[begin:end], self.reverse_weights[begin:end])
+    ]
+
+  def estimate(self, state, target):
+    if self.coords is None:
+      return 0
+    coords = self.coords
+    dx = coords[2 * state] - coords[2 * target]
+    dy = coords[2 * state + 1] - coords[2 * target + 1]
+    distance = math.hypot(dx, dy)
+    if math.isnan(distance):
+      return 0
+    return distance * self.coord_scale
+
+  def lower_bound(self, source, target):
+    bound = self.estimate(source, target)
+    if self.landmarks is not None:
+      bound = max(bound, self.landmarks.lower_bound(source, target))
+    return bound
+
+  def evaluate(self, state):
+    return self.lower_bound(state, self.goal)
+
+  def reverse_heuristic(self, node):
+    return self.lower_bound(self.start, node.state)
+
+
+def csr_dijkstra(offsets, targets, weights, source):
+  distances = array.array("d", [math.inf]) * (len(offsets) - 1)
+  distances[source] = 0.0
+  frontier = [(0.0, source)]
+  while frontier:
+    (distance, node) = heapq.heappop(frontier)
+    if distance > distances[node]:
+      continue
+    for slot in range(offsets[node], offsets[node + 1]):
+      candidate = distance + weights[slot]
+      target = targets[slot]
+      if candidate < distances[target]:
+        distances[target] = candidate
+        heapq.heappush(frontier, (candidate, target))
+  return distances
+
+
+class LandmarkTable:
+  # forward[i * num_nodes + v] is the distance from landmark i to v and
+  # backward[i * num_nodes + v] the distance from v to landmark i
+  def __init__(self, landmarks, num_nodes, forward, backward):
+    self.landmarks = landmarks
+    self.num_nodes = num_nodes
+    self.forward = forward
+    self.backward = backward
+
+  @classmethod
+  def build(cls, env, count=8, seed=0):
+    # farthest selection: the first landmark is the node farthest from a
+    # random one, each later one the node farthest from all chosen so far
+    num_nodes = env.num_nodes()
+    env.build_reverse()
+    nearest = csr_dijkstra(env.offsets, env.targets, env.weights, random.Random(seed).randrange(num_nodes))
+    landmarks = []
+    forward = array.array("d")
+    backward = array.array("d")
+    for _ in range(min(count, num_nodes)):
+      candidates = [node for node in range(num_nodes) if 0 < nearest[node] < math.inf]
+      if not candidates:
+        break
+      landmark = max(candidates, key=nearest.__getitem__)
+      from_landmark = csr_dijkstra(env.offsets, env.targets, env.weights, landmark)
+      forward.extend(from_landmark)
+      backward.extend(csr_dijkstra(env.reverse_offsets, env.reverse_sources, env.reverse_weights, landmark))
+      if landmarks:
+        nearest = array.array("d", map(min, nearest, from_landmark))
+      else:
+        nearest = from_landmark
+      landmarks.append(landmark)
+    return cls(landmarks, num_nodes, forward, backward)
+
+  def save(self, path):
+    header = array.array("q", [len(self.landmarks), self.num_nodes] + list(self.landmarks))
+    with open(path, "wb") as table_file:
+      table_file.write(header.tobytes())
+      table_file.write(memoryview(self.forward).cast("B"))
+      table_file.write(memoryview(self.backward).cast("B"))
+
+  @classmethod
+  def load(cls, path):
+    with open(path, "rb") as table_file:
+      mapped = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    (count, num_nodes) = view[:16].cast("q")
+    landmarks = list(view[16:16 + 8 * count].cast("q"))
+    start = 16 + 8 * count
+    size = 8 * count * num_nodes
+    forward = view[start:start + size].cast("d")
+    backward = view[start + size:start + 2 * size].cast("d")
+    return cls(landmarks, num_nodes, forward, backward)
+
+  def lower_bound(self, source, target):
+    # triangle inequality: d(s, t) >= d(L, t) - d(L, s) and d(s, t) >= d(s, L) - d(t, L)
+    bound = 0.0
+    forward = self.forward
+    backward = self.backward
+    for base in range(0, len(self.landmarks) * self.num_nodes, self.num_nodes):
+      if forward[base + source] < math.inf:
+        bound = max(bound, forward[base + target] - forward[base + source])
+      if backward[base + target] < math.inf:
+        bound = max(bound, backward[base + source] - backward[base + target])
+    return bound
+
+
+class VacuumPatternAbstraction:
+  # keeps the agent location and the dirt on the pattern tiles only; for an
+  # additive combination, let at most one abstraction count the moves
+  def __init__(self, num_tiles, pattern, count_moves=True):
+    self.num_tiles = num_tiles
+    self.pattern = tuple(pattern)
+    self.count_moves = count_moves
+
+  def size(self):
+    return self.num_tiles << len(self.pattern)
+
+  def abstract(self, state):
+    mask = 0
+    for (bit, tile) in enumerate(self.pattern):
+      if state.tiles[tile] == "dirty":
+        mask |= 1 << bit
+    return (state.agent_loc, mask)
+
+  def rank(self, abstract_state):
+    (agent_loc, mask) = abstract_state
+    return (agent_loc << len(self.pattern)) | mask
+
+  def unrank(self, rank):
+    return (rank >> len(self.pattern), rank & ((1 << len(self.pattern)) - 1))
+
+  def is_goal(self, abstract_state):
+    return abstract_state[1] == 0
+
+  def successors(self, abstract_state):
+    (agent_loc, mask) = abstract_state
+    move_cost = 1 if self.count_moves else 0
+    if agent_loc > 0:
+      yield ((agent_loc - 1, mask), move_cost)
+    if agent_loc < self.num_tiles - 1:
+      yield ((agent_loc + 1, mask), move_cost)
+    if agent_loc in self.pattern:
+      bit = 1 << self.pattern.index(agent_loc)
+      if mask & bit:
+        yield ((agent_loc, mask ^ bit), 1)
+
+
+class GridVacuumPatternAbstraction(VacuumPatternAbstraction):
+  # the same abstraction over GridVacuumState: the pattern picks bits of dirt
+  def __init__(self, width, height, pattern, count_moves=True):
+    super().__init__(width * height, pattern, count_moves)
+    self.width = width
+    self.height = height
+
+  def abstract(self, state):
+    mask = 0
+    for (bit, tile) in enumerate(self.pattern):
+      if state.dirt >> tile & 1:
+        mask |= 1 << bit
+    return (state.agent_loc, mask)
+
+  def successors(self, abstract_state):
+    (agent_loc, mask) = abstract_state
+    move_cost = 1 if self.count_moves else 0
+    if agent_loc % self.width > 0:
+      yield ((agent_loc - 1, mask), move_cost)
+    if agent_loc % self.width < self.width - 1:
+      yield ((agent_loc + 1, mask), move_cost)
+    if agent_loc >= self.width:
+      yield ((agent_loc - self.width, mask), move_cost)
+    if agent_loc < self.width * (self.height - 1):
+      yield ((agent_loc + self.width, mask), move_cost)
+    if agent_loc in self.pattern:
+      bit = 1 << self.pattern.index(agent_loc)
+      if mask & bit:
+        yield ((agent_loc, mask ^ bit), 1)
+
+
+class PatternDatabase:
+  UNREACHABLE = 0xFFFF
+
+  def __init__(self, abstraction, table):
+    self.abstraction = abstraction
+    self.table = table
+
+  @classmethod
+  def build(cls, abstraction):
+    # 0-1 BFS backwards from every abstract goal over the reversed abstract graph
+    size = abstraction.size()
+    sources = array.array("i")
+    targets = array.array("i")
+    weights = array.array("d")
+    for rank in range(size):
+      for (successor, cost) in abstraction.successors(abstraction.unrank(rank)):
+        if cost not in (0, 1):
+          raise ValueError("pattern database edges must cost 0 or 1")
+        sources.append(abstraction.rank(successor))
+        targets.append(rank)
+        weights.append(cost)
+    (offsets, reverse_targets, reverse_weights) = build_csr(size, sources, targets, weights)
+    table = array.array("H", [cls.UNREACHABLE]) * size
+    frontier = collections.deque()
+    for rank in range(size):
+      if abstraction.is_goal(abstraction.unrank(rank)):
+        table[rank] = 0
+        frontier.append(rank)
+    while frontier:
+      rank = frontier.popleft()
+      distance = table[rank]
+      for slot in range(offsets[rank], offsets[rank + 1]):
+        predecessor = reverse_targets[slot]
+        cost = int(reverse_weights[slot])
+        if distance + cost < table[predecessor]:
+          if distance + cost >= cls.UNREACHABLE:
+            raise OverflowError("pattern database distance does not fit in 16 bits")
+          table[predecessor] = distance + cost
+          if cost:
+            frontier.append(predecessor)
+          else:
+            frontier.appendleft(predecessor)
+    return cls(abstraction, table)
+
+  def save(self, path):
+    with open(path, "wb") as table_file:
+      table_file.write(bytes(memoryview(self.table).cast("B")))
+
+  @classmethod
+  def load(cls, abstraction, path):
+    with open(path, "rb") as table_file:
+      mapped = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+    table = memoryview(mapped).cast("H")
+    if len(table) != abstraction.size():
+      raise ValueError("%s holds %d entries, the abstraction needs %d" % (path, len(table), abstraction.size()))
+    return cls(abstraction, table)
+
+  def lookup(self, state):
+    abstraction = self.abstraction
+    distance = self.table[abstraction.rank(abstraction.abstract(state))]
+    return math.inf if distance == self.UNREACHABLE else distance
+
+
 # YOUR AGENT FUNCTIONS GO HERE
 def greedy_search_agent(root, env):
     frontier = []
@@ -169,49 +523,907 @@ def greedy_search_agent(root, env):
     visited = set()
     tiebreaker = 0
     while frontier:
+        env.record_frontier(len(frontier))
         node = heapq.heappop(frontier)[2]
-        visited.add(str(node.state))
+        visited.add(state_key(node.state))
         if env.is_goal(node):
             return node
-        for successor in env.get_successors(node):
-            if str(successor.state) in visited:
-                continue
+        successors = []
+        for successor in env.iter_successors(node):
+            if state_key(successor.state) in visited:
+                env.record_duplicate()
+            else:
+                successors.append(successor)
+        for (successor, estimate) in zip(successors, env.heuristic_many(successors)):
             tiebreaker += 1
-            heapq.heappush(frontier, (env.heuristic(successor), tiebreaker, successor))
+            heapq.heappush(frontier, (estimate, tiebreaker, successor))
 
   #return 0
 
+def beam_search_agent(root, env, beam_width=100, diversity=None, max_depth=None):
+  # keeps only the beam_width best nodes of each depth layer, so memory stays
+  # bounded at the cost of completeness; diversity caps how many children of
+  # any one parent may enter the next layer; each layer follows from the
+  # previous one's (state, parent state) sequence, so a repeat of that
+  # sequence means the beam is cycling and will never reach a goal
+  beam = [root]
+  depth = 0
+  seen_layers = set()
+  while beam and (max_depth is None or depth <= max_depth):
+    env.record_frontier(len(beam))
+    for node in beam:
+      if env.is_goal(node):
+        return node
+    layer = {}
+    for (rank, node) in enumerate(beam):
+      backtrack_key = state_key(node.parent.state) if node.parent else None
+      for successor in env.iter_successors(node):
+        successor_key = state_key(successor.state)
+        if successor_key != backtrack_key and successor_key not in layer:
+          layer[successor_key] = (rank, successor)
+        else:
+          env.record_duplicate()
+    candidates = list(layer.values())
+    estimates = env.heuristic_many([successor for (_, successor) in candidates])
+    order = sorted(range(len(candidates)), key=estimates.__getitem__)
+    beam = []
+    children = collections.Counter()
+    for index in order:
+      (rank, successor) = candidates[index]
+      if diversity is not None and children[rank] >= diversity:
+        continue
+      children[rank] += 1
+      beam.append(successor)
+      if len(beam) == beam_width:
+        break
+    layer_keys = tuple((state_key(node.state), state_key(node.parent.state)) for node in beam)
+    if layer_keys in seen_layers:
+      return None
+    seen_layers.add(layer_keys)
+    depth += 1
+  return None
+
 def a_star_agent(root, env):
-    frontier = []
-    heapq.heappush(frontier, (0, 0, root))
+    frontier = IndexedHeap()
+    frontier.push(state_key(root.state), 0, root)
     best_cost = {}
-    best_cost[str(root. state)] = 0
-    tiebreaker = 0
+    best_cost[state_key(root.state)] = 0
     while frontier:
-        node = heapq.heappop(frontier)[2]
+        env.record_frontier(len(frontier))
+        key, _, node = frontier.pop()
         if env.is_goal(node):
             return node
-        for successor in env. get_successors (node):
-            prev_best_cost = best_cost.get(str(successor.state), math.inf)
-            new_best_cost = best_cost[str (node.state)] + successor.cost
+        node_cost = best_cost[key]
+        improved = []
+        for successor in env.iter_successors(node):
+            successor_key = state_key(successor.state)
+            prev_best_cost = best_cost.get(successor_key, math.inf)
+            new_best_cost = node_cost + successor.cost
             if new_best_cost < prev_best_cost:
-                tiebreaker += 1
-                best_cost [str(successor.state)] = new_best_cost
-                heapq.heappush(frontier, (new_best_cost + env. heuristic(successor), tiebreaker, successor))
+                best_cost[successor_key] = new_best_cost
+                improved.append((successor_key, new_best_cost, successor))
+            else:
+                env.record_duplicate()
+        estimates = env.heuristic_many([successor for (_, _, successor) in improved])
+        for ((successor_key, new_best_cost, successor), estimate) in zip(improved, estimates):
+            frontier.push(successor_key, new_best_cost + estimate, successor)
 
  # return 0
 
+def ara_star_search(root, env, weight=3.0, weight_step=0.5, time_limit=None, max_expansions=None):
+  # anytime repairing A*: yields (goal node, suboptimality bound) whenever the
+  # solution improves, lowering the heuristic weight towards 1 in between
+  deadline = math.inf if time_limit is None else time.perf_counter() + time_limit
+  expansion_limit = math.inf if max_expansions is None else env.nodes_expanded + max_expansions
+  root_key = state_key(root.state)
+  best_cost = {root_key: 0}
+  best_node = {root_key: root}
+  estimates = {root_key: env.heuristic(root)}
+  open_heap = IndexedHeap()
+  open_heap.push(root_key, weight * estimates[root_key], root)
+  closed = set()
+  inconsistent = set()
+  goal_key = None
+  reported = (math.inf, math.inf)
+  while True:
+    incumbent_cost = math.inf if goal_key is None else best_cost[goal_key]
+    while open_heap.top_priority() < incumbent_cost:
+      if time.perf_counter() > deadline or env.nodes_expanded >= expansion_limit:
+        return
+      env.record_frontier(len(open_heap))
+      key, _, node = open_heap.pop()
+      closed.add(key)
+      if env.is_goal(node):
+        goal_key = key
+        incumbent_cost = best_cost[key]
+        continue
+      node_cost = best_cost[key]
+      improved = []
+      for successor in env.iter_successors(node):
+        successor_key = state_key(successor.state)
+        new_best_cost = node_cost + successor.cost
+        if new_best_cost < best_cost.get(successor_key, math.inf):
+          best_cost[successor_key] = new_best_cost
+          best_node[successor_key] = successor
+          if successor_key in closed:
+            inconsistent.add(successor_key)
+          else:
+            improved.append((successor_key, new_best_cost, successor))
+        else:
+          env.record_duplicate()
+      missing = [successor for (successor_key, _, successor) in improved if successor_key not in estimates]
+      for (successor, estimate) in zip(missing, env.heuristic_many(missing)):
+        estimates[state_key(successor.state)] = estimate
+      for (successor_key, new_best_cost, successor) in improved:
+        open_heap.push(successor_key, new_best_cost + weight * estimates[successor_key], successor)
+    if goal_key is None:
+      return
+    pending = [entry[2] for entry in open_heap.entries] + list(inconsistent)
+    lower_bound = min([best_cost[key] + estimates[key] for key in pending], default=incumbent_cost)
+    if lower_bound > 0:
+      bound = min(weight, incumbent_cost / lower_bound)
+    else:
+      bound = 1.0 if incumbent_cost == 0 else weight
+    bound = max(bound, 1.0)
+    if (incumbent_cost, bound) < reported:
+      reported = (incumbent_cost, bound)
+      yield best_node[goal_key], bound
+    if weight <= 1.0:
+      return
+    # no point searching with a weight above the bound already proven
+    weight = max(1.0, min(weight - weight_step, bound))
+    open_heap = IndexedHeap()
+    for key in pending:
+      open_heap.push(key, best_cost[key] + weight * estimates[key], best_node[key])
+    closed = set()
+    inconsistent = set()
+
+def ara_star_agent(root, env, weight=3.0, weight_step=0.5, time_limit=None, max_expansions=None):
+  goal = None
+  for (goal, _) in ara_star_search(root, env, weight, weight_step, time_limit, max_expansions):
+    pass
+  return goal
+
+def read_batches(path):
+  with open(path, "rb") as batch_file:
+    while True:
+      try:
+        yield from pickle.load(batch_file)
+      except EOFError:
+        return
+
+class ExternalAStar:
+  # frontier records (f, g, state, parent offset, action, cost) are appended
+  # in batches to one file per f-bucket; closed states go to append-only
+  # runs that are scanned sequentially against a loaded bucket's dict of
+  # candidates, and expanded records go to a trace file that rebuilds the
+  # path; only the bucket being expanded is held in memory
+  def __init__(self, directory, env, bucket_width=1.0, batch_size=4096, max_runs=8):
+    self.directory = directory
+    self.env = env
+    self.bucket_width = bucket_width
+    self.batch_size = batch_size
+    self.max_runs = max_runs
+    self.buffers = {}
+    self.pending = set()
+    self.queued = 0
+    self.runs = []
+    self.files_written = 0
+    self.trace = open(os.path.join(directory, "trace"), "w+b", buffering=1 << 20)
+
+  def close(self):
+    self.trace.close()
+
+  def bucket_path(self, bucket):
+    return os.path.join(self.directory, "bucket-%d" % bucket)
+
+  def spill(self, bucket):
+    records = self.buffers.pop(bucket, None)
+    if records:
+      with open(self.bucket_path(bucket), "ab") as bucket_file:
+        pickle.dump(records, bucket_file, pickle.HIGHEST_PROTOCOL)
+
+  def add(self, f, record):
+    bucket = int(f // self.bucket_width)
+    records = self.buffers.setdefault(bucket, [])
+    records.append(record)
+    self.pending.add(bucket)
+    self.queued += 1
+    if len(records) >= self.batch_size:
+      self.spill(bucket)
+
+  def take(self, bucket):
+    self.spill(bucket)
+    self.pending.discard(bucket)
+    path = self.bucket_path(bucket)
+    if not os.path.exists(path):
+      return []
+    records = list(read_batches(path))
+    os.remove(path)
+    self.queued -= len(records)
+    return records
+
+  def write_run(self, entries):
+    path = os.path.join(self.directory, "closed-%d" % self.files_written)
+    self.files_written += 1
+    with open(path, "wb") as run_file:
+      batch = []
+      for entry in entries:
+        batch.append(entry)
+        if len(batch) == self.batch_size:
+          pickle.dump(batch, run_file, pickle.HIGHEST_PROTOCOL)
+          batch = []
+      if batch:
+        pickle.dump(batch, run_file, pickle.HIGHEST_PROTOCOL)
+    self.runs.append(path)
+
+  def close_round(self, closed):
+    if not closed:
+      return
+    self.write_run(closed)
+    if len(self.runs) > self.max_runs:
+      old_runs = self.runs
+      self.runs = []
+      self.write_run(entry for run in old_runs for entry in read_batches(run))
+      for run in old_runs:
+        os.remove(run)
+
+  def drop_closed(self, candidates):
+    for run in self.runs:
+      for (key, cost) in read_batches(run):
+        record = candidates.get(key)
+        if record is not None and cost <= record[1]:
+          del candidates[key]
+          self.env.record_duplicate()
+
+  def write_trace(self, parent_offset, action, cost, state):
+    offset = self.trace.tell()
+    pickle.dump((parent_offset, action, cost, state), self.trace, pickle.HIGHEST_PROTOCOL)
+    return offset
+
+  def rebuild(self, offset):
+    self.trace.flush()
+    entries = []
+    while offset >= 0:
+      self.trace.seek(offset)
+      (offset, action, cost, state) = pickle.load(self.trace)
+      entries.append((state, action, cost))
+    node = None
+    for (state, action, cost) in reversed(entries):
+      node = Node(state, action, cost, node)
+    return node
+
+  def search(self, root):
+    env = self.env
+    estimate = env.heuristic(root)
+    self.add(estimate, (estimate, 0, root.state, -1, root.action, root.cost))
+    incumbent = None
+    while self.pending:
+      bucket = min(self.pending)
+      if incumbent is not None and bucket * self.bucket_width >= incumbent[0]:
+        break
+      while True:
+        records = self.take(bucket)
+        if not records:
+          break
+        candidates = {}
+        for record in records:
+          key = state_key(record[2])
+          if key in candidates:
+            env.record_duplicate()
+          if key not in candidates or record[1] < candidates[key][1]:
+            candidates[key] = record
+        self.drop_closed(candidates)
+        closed = []
+        for (key, record) in sorted(candidates.items(), key=lambda item: item[1][0]):
+          (f, g, state, parent_offset, action, cost) = record
+          if incumbent is not None and f >= incumbent[0]:
+            break
+          env.record_frontier(self.queued)
+          offset = self.write_trace(parent_offset, action, cost, state)
+          closed.append((key, g))
+          node = Node(state, action, cost, None)
+          if env.is_goal(node):
+            if incumbent is None or g < incumbent[0]:
+              incumbent = (g, offset)
+            continue
+          children = list(env.iter_successors(node))
+          for (child, child_estimate) in zip(children, env.heuristic_many(children)):
+            child_cost = g + child.cost
+            child_f = child_cost + child_estimate
+            if child_f < math.inf:
+              # an inconsistent estimate may point back below the current bucket
+              self.add(max(child_f, bucket * self.bucket_width), (child_f, child_cost, child.state, offset, child.action, child.cost))
+        self.close_round(closed)
+    return None if incumbent is None else self.rebuild(incumbent[1])
+
+def external_a_star_agent(root, env, directory=None, bucket_width=1.0, batch_size=4096, max_runs=8):
+  with tempfile.TemporaryDirectory(dir=directory) as workspace:
+    search = ExternalAStar(workspace, env, bucket_width, batch_size, max_runs)
+    try:
+      return search.search(root)
+    finally:
+      search.close()
+
+def deep_size(value):
+  size = sys.getsizeof(value)
+  if isinstance(value, (tuple, list, frozenset, set)):
+    size += sum(deep_size(item) for item in value)
+  return size
+
+def node_budget(root, max_nodes=None, max_bytes=None, overhead=0):
+  # overhead is whatever the agent keeps per node besides the Node and its state
+  if max_bytes is None:
+    return math.inf if max_nodes is None else max_nodes
+  node_bytes = sys.getsizeof(root) + deep_size(root.state) + overhead
+  budget = max(1, max_bytes // node_bytes)
+  return budget if max_nodes is None else min(budget, max_nodes)
+
+def ida_star_agent(root, env, max_nodes=None, max_bytes=None):
+  # the budget caps the length of the path held in memory
+  depth_limit = node_budget(root, max_nodes, max_bytes)
+
+  def search(bound):
+    # an explicit stack of [node, cost, key, successors, smallest pruned f]
+    # frames, so the path length is not limited by the interpreter's recursion
+    on_path = set()
+    stack = []
+    (node, cost) = (root, 0)
+    while node is not None:
+      env.record_frontier(len(on_path) + 1)
+      f = cost + env.heuristic(node)
+      if f > bound:
+        pruned = f
+      elif env.is_goal(node):
+        return (node, f)
+      elif len(on_path) + 1 >= depth_limit:
+        pruned = math.inf
+      else:
+        key = state_key(node.state)
+        on_path.add(key)
+        stack.append([node, cost, key, env.iter_successors(node), math.inf])
+        pruned = None
+      node = None
+      while stack:
+        frame = stack[-1]
+        if pruned is not None:
+          frame[4] = min(frame[4], pruned)
+          pruned = None
+        for child in frame[3]:
+          if state_key(child.state) in on_path:
+            env.record_duplicate()
+            continue
+          (node, cost) = (child, frame[1] + child.cost)
+          break
+        if node is not None:
+          break
+        stack.pop()
+        on_path.remove(frame[2])
+        pruned = frame[4]
+    return (None, pruned)
+
+  bound = env.heuristic(root)
+  while bound < math.inf:
+    (goal, bound) = search(bound)
+    if goal:
+      return goal
+  return None
+
+class SMAStarEntry:
+  __slots__ = ("node", "cost", "f", "depth", "parent", "children", "forgotten", "in_open", "alive", "version")
+
+  def __init__(self, node, cost, f, depth, parent):
+    self.node = node
+    self.cost = cost
+    self.f = f
+    self.depth = depth
+    self.parent = parent
+    self.children = []
+    self.forgotten = None # state key -> f of pruned children, once expanded
+    self.in_open = True
+    self.alive = True
+    self.version = 0
+
+# compaction keeps each heap within this many items per stored entry
+SMA_HEAP_SLACK = 2
+
+def sma_entry_bytes(root):
+  entry = SMAStarEntry(root, 0.0, 0.0, 0, None)
+  entry.forgotten = {}
+  # a heap item is a list slot, the tuple and its boxed f, depth, counter and version
+  heap_item = 8 + sys.getsizeof((0.0, 0, 0, 0, entry)) + sys.getsizeof(0.0) + 3 * sys.getsizeof(1 << 20)
+  # the entry sits in its parent's children list and owns a list and a dict of its own
+  return sys.getsizeof(entry) + 8 + sys.getsizeof(entry.children) + sys.getsizeof(entry.forgotten) + 2 * SMA_HEAP_SLACK * heap_item
+
+def sma_star_agent(root, env, max_nodes=None, max_bytes=None):
+  limit = node_budget(root, max_nodes, max_bytes, sma_entry_bytes(root))
+  open_heap = []
+  leaf_heap = []
+  counter = 0
+  stored = 1
+
+  def queue(entry):
+    nonlocal counter
+    counter += 1
+    entry.version += 1
+    heapq.heappush(open_heap, (entry.f, -entry.depth, counter, entry.version, entry))
+    heapq.heappush(leaf_heap, (-entry.f, entry.depth, counter, entry.version, entry))
+
+  def backup(entry):
+    while entry is not None:
+      f = min([child.f for child in entry.children] + list(entry.forgotten.values()), default=math.inf)
+      if f == entry.f:
+        return
+      entry.f = f
+      queue(entry)
+      entry = entry.parent
+
+  def prune_worst_leaf(protected):
+    nonlocal stored
+    skipped = []
+    while leaf_heap:
+      item = heapq.heappop(leaf_heap)
+      leaf = item[4]
+      if not (leaf.alive and leaf.version == item[3] and not leaf.children and leaf.parent):
+        continue
+      if leaf is protected:
+        skipped.append(item)
+        continue
+      break
+    else:
+      leaf = None
+    for item in skipped:
+      heapq.heappush(leaf_heap, item)
+    if leaf is None:
+      return False
+    leaf.alive = False
+    stored -= 1
+    parent = leaf.parent
+    parent.children.remove(leaf)
+    parent.forgotten[state_key(leaf.node.state)] = leaf.f
+    parent.in_open = parent.in_open or leaf.f < math.inf
+    queue(parent)
+    backup(parent)
+    return True
+
+  def compact_heaps():
+    # drop stale heap entries so the bookkeeping stays within the budget too
+    open_heap.clear()
+    leaf_heap.clear()
+    stack = [start]
+    while stack:
+      entry = stack.pop()
+      queue(entry)
+      stack.extend(entry.children)
+
+  start = SMAStarEntry(root, 0, env.heuristic(root), 0, None)
+  queue(start)
+  while open_heap:
+    (_, _, _, version, entry) = heapq.heappop(open_heap)
+    if not (entry.alive and entry.in_open and entry.version == version):
+      continue
+    env.record_frontier(stored)
+    if entry.f == math.inf:
+      return None
+    if env.is_goal(entry.node):
+      return entry.node
+    cheapest = {}
+    for successor in env.get_successors(entry.node):
+      key = state_key(successor.state)
+      if key in cheapest:
+        env.record_duplicate()
+      if key not in cheapest or successor.cost < cheapest[key].cost:
+        cheapest[key] = successor
+    if entry.forgotten is None:
+      # first expansion: generate every successor not already on the path
+      entry.forgotten = {}
+      ancestor = entry
+      while ancestor:
+        if cheapest.pop(state_key(ancestor.node.state), None) is not None:
+          env.record_duplicate()
+        ancestor = ancestor.parent
+      generated = [(entry.f, successor) for successor in cheapest.values()]
+    else:
+      # re-expansion: regenerate only the most promising forgotten child
+      key = min(entry.forgotten, key=entry.forgotten.get)
+      generated = [(entry.forgotten.pop(key), cheapest[key])]
+    best_child = None
+    for (f, successor) in generated:
+      cost = entry.cost + successor.cost
+      if entry.depth + 2 >= limit and not env.goal_test(successor.state):
+        f = math.inf
+      else:
+        f = max(f, cost + env.heuristic(successor))
+      child = SMAStarEntry(successor, cost, f, entry.depth + 1, entry)
+      entry.children.append(child)
+      stored += 1
+      queue(child)
+      if best_child is None or f < best_child.f:
+        best_child = child
+    entry.in_open = min(entry.forgotten.values(), default=math.inf) < math.inf
+    queue(entry)
+    backup(entry)
+    while stored > limit and prune_worst_leaf(best_child):
+      pass
+    if len(open_heap) > SMA_HEAP_SLACK * stored + 64:
+      compact_heaps()
+  return None
+
+def bidirectional_search(root, env, forward_heuristic, backward_heuristic):
+  # both heuristics None means uniform-cost in both directions; otherwise each
+  # side runs on the balanced potential (h_forward - h_backward) / 2, negated
+  # backwards, so the two frontiers agree and one stopping rule fits both
+  def get_predecessors(node):
+    return [
+      Node(state, action, cost, node)
+      for (state, action, cost) in env.get_predecessors(node.state)
+    ]
+
+  def estimates(node):
+    if forward_heuristic is None:
+      return (0, 0)
+    return (forward_heuristic(node), backward_heuristic(node))
+
+  goal = Node(env.goal_state(), None, 0, None)
+  searches = [
+    (root, 1, env.get_successors),
+    (goal, -1, get_predecessors),
+  ]
+  frontiers = []
+  best_costs = []
+  best_nodes = []
+  for (direction, (start, sign, _)) in enumerate(searches):
+    (forward_estimate, backward_estimate) = estimates(start)
+    potential = sign * (forward_estimate - backward_estimate) / 2
+    bound = forward_estimate if direction == 0 else backward_estimate
+    frontiers.append([(potential, 0, start, bound)])
+    best_costs.append({state_key(start.state): 0})
+    best_nodes.append({state_key(start.state): start})
+  best_total = math.inf
+  meeting = None
+  if state_key(goal.state) in best_costs[0]:
+    (best_total, meeting) = (0, (root, goal))
+  tiebreaker = 0
+  while frontiers[0] and frontiers[1]:
+    if frontiers[0][0][0] + frontiers[1][0][0] >= best_total:
+      break
+    env.record_frontier(len(frontiers[0]) + len(frontiers[1]))
+    direction = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+    (_, sign, expand) = searches[direction]
+    (_, _, node, bound) = heapq.heappop(frontiers[direction])
+    key = state_key(node.state)
+    if best_nodes[direction][key] is not node or bound >= best_total:
+      continue
+    env.nodes_expanded += 1
+    node_cost = best_costs[direction][key]
+    other_costs = best_costs[1 - direction]
+    for child in expand(node):
+      child_key = state_key(child.state)
+      new_cost = node_cost + child.cost
+      if new_cost >= best_costs[direction].get(child_key, math.inf):
+        env.record_duplicate()
+        continue
+      best_costs[direction][child_key] = new_cost
+      best_nodes[direction][child_key] = child
+      if child_key in other_costs and new_cost + other_costs[child_key] < best_total:
+        best_total = new_cost + other_costs[child_key]
+        meeting = (child, best_nodes[1 - direction][child_key]) if direction == 0 else (best_nodes[0][child_key], child)
+      (forward_estimate, backward_estimate) = estimates(child)
+      bound = new_cost + (forward_estimate if direction == 0 else backward_estimate)
+      if bound >= best_total:
+        continue
+      tiebreaker += 1
+      priority = new_cost + sign * (forward_estimate - backward_estimate) / 2
+      heapq.heappush(frontiers[direction], (priority, tiebreaker, child, bound))
+  if meeting is None:
+    return None
+  (node, backward_node) = meeting
+  while backward_node.parent:
+    node = Node(backward_node.parent.state, backward_node.action, backward_node.cost, node)
+    backward_node = backward_node.parent
+  return node
+
+def bidirectional_ucs_agent(root, env):
+  return bidirectional_search(root, env, None, None)
+
+def bidirectional_a_star_agent(root, env):
+  reverse_heuristic = getattr(env, "reverse_heuristic", lambda node: 0)
+  return bidirectional_search(root, env, env.heuristic, reverse_heuristic)
+
+class PortfolioCancelled(Exception):
+  pass
+
+def agent_name(agent):
+  return getattr(agent, "__name__", None) or agent.func.__name__
+
+def portfolio_worker(index, agent, root, env, results):
+  def cancel(signum, frame):
+    raise PortfolioCancelled()
+
+  signal.signal(signal.SIGTERM, cancel)
+  start = time.perf_counter()
+  steps = None
+  status = "finished"
+  try:
+    goal = agent(root, env)
+    if goal is not None:
+      steps = []
+      while goal.parent:
+        steps.append((goal.state, goal.action, goal.cost))
+        goal = goal.parent
+      steps.reverse()
+  except PortfolioCancelled:
+    status = "cancelled"
+  except Exception as error:
+    status = "error: " + type(error).__name__
+  signal.signal(signal.SIGTERM, signal.SIG_IGN)
+  results.put((index, status, steps, env.nodes_expanded, time.perf_counter() - start))
+
+def run_portfolio(root, env, agents=None, accept=None, timeout=None):
+  if agents is None:
+    agents = [coen266_w2.dfs_agent, coen266_w2.bfs_agent, coen266_w2.ucs_agent,
+              greedy_search_agent, a_star_agent]
+  results = multiprocessing.Queue()
+  workers = [
+    multiprocessing.Process(target=portfolio_worker, args=(index, agent, root, env, results), daemon=True)
+    for (index, agent) in enumerate(agents)
+  ]
+  for worker in workers:
+    worker.start()
+  reports = [
+    {"agent": agent_name(agent), "status": "running", "nodes_expanded": None, "wall_time": None}
+    for agent in agents
+  ]
+  pending = len(workers)
+  winner = None
+  deadline = None if timeout is None else time.monotonic() + timeout
+  while pending and winner is None:
+    remaining = None if deadline is None else deadline - time.monotonic()
+    if remaining is not None and remaining <= 0:
+      break
+    try:
+      # poll, so workers that die without reporting cannot hang the race
+      (index, status, steps, nodes_expanded, wall_time) = results.get(timeout=min(0.1, remaining or 0.1))
+    except queue.Empty:
+      if not any(worker.is_alive() for worker in workers) and results.empty():
+        break
+      continue
+    pending -= 1
+    goal = None
+    if steps is not None:
+      goal = root
+      for (state, action, cost) in steps:
+        goal = Node(state, action, cost, goal)
+    reports[index].update(status=status, nodes_expanded=nodes_expanded, wall_time=wall_time)
+    if goal is not None and (accept is None or accept(goal)):
+      reports[index]["status"] = "winner"
+      winner = goal
+  for worker in workers:
+    if worker.is_alive():
+      worker.terminate()
+  while pending:
+    try:
+      (index, status, _, nodes_expanded, wall_time) = results.get(timeout=1)
+    except queue.Empty:
+      break
+    pending -= 1
+    reports[index].update(status=status, nodes_expanded=nodes_expanded, wall_time=wall_time)
+  for worker in workers:
+    worker.join(timeout=1)
+    if worker.is_alive():
+      worker.kill()
+      worker.join()
+  for (report, worker) in zip(reports, workers):
+    if report["status"] == "running":
+      report["status"] = "cancelled" if worker.exitcode in (0, -signal.SIGTERM, -signal.SIGKILL) else "error: exited"
+  return (winner, reports)
+
+def canonical_bytes(key):
+  # equal keys always encode alike, unlike pickle (which memoizes repeated
+  # objects by identity) or hash() (salted per process for str)
+  if isinstance(key, tuple):
+    return b"(" + b",".join(canonical_bytes(item) for item in key) + b")"
+  if isinstance(key, frozenset):
+    return b"{" + b",".join(sorted(canonical_bytes(item) for item in key)) + b"}"
+  return repr(key).encode()
+
+def state_owner(key, workers):
+  return zlib.crc32(canonical_bytes(key)) % workers
+
+def hda_star_worker(index, workers, env, inboxes, results, poll_every):
+  # records are (f, g, state, parent reference, action, cost), where a parent
+  # reference is (worker, position in that worker's expanded list)
+  inbox = inboxes[index]
+  open_heap = IndexedHeap()
+  best_cost = {}
+  expanded = []
+  outgoing = [[] for _ in range(workers)]
+  incumbent = math.inf
+  sent = 0
+  received = 0
+
+  def receive(record):
+    key = state_key(record[2])
+    if record[1] < best_cost.get(key, math.inf):
+      best_cost[key] = record[1]
+      open_heap.push(key, record[0], record)
+    else:
+      env.record_duplicate()
+
+  def flush():
+    nonlocal sent
+    for owner in range(workers):
+      if outgoing[owner]:
+        inboxes[owner].put(("work", outgoing[owner]))
+        outgoing[owner] = []
+        sent += 1
+
+  def handle(message):
+    nonlocal incumbent, received
+    kind = message[0]
+    if kind == "work":
+      received += 1
+      for record in message[1]:
+        receive(record)
+    elif kind == "incumbent":
+      incumbent = min(incumbent, message[1])
+    elif kind == "probe":
+      idle = open_heap.top_priority() >= incumbent
+      results.put(("probe", message[1], index, idle, sent, received, env.nodes_expanded, env.peak_frontier))
+    elif kind == "trace":
+      results.put(("trace",) + expanded[message[1]])
+    return kind != "stop"
+
+  try:
+    running = True
+    while running:
+      if open_heap.top_priority() >= incumbent:
+        flush()
+        running = handle(inbox.get())
+        continue
+      while running:
+        try:
+          message = inbox.get_nowait()
+        except queue.Empty:
+          break
+        running = handle(message)
+      for _ in range(poll_every):
+        if not running or open_heap.top_priority() >= incumbent:
+          break
+        env.record_frontier(len(open_heap))
+        (_, _, (f, g, state, parent, action, cost)) = open_heap.pop()
+        reference = (index, len(expanded))
+        expanded.append((state, action, cost, parent))
+        node = Node(state, action, cost, None)
+        if env.is_goal(node):
+          if g < incumbent:
+            incumbent = g
+            results.put(("goal", g, reference))
+          continue
+        children = list(env.iter_successors(node))
+        for (child, estimate) in zip(children, env.heuristic_many(children)):
+          child_cost = g + child.cost
+          if child_cost + estimate >= incumbent:
+            continue
+          record = (child_cost + estimate, child_cost, child.state, reference, child.action, child.cost)
+          owner = state_owner(state_key(child.state), workers)
+          if owner == index:
+            receive(record)
+          else:
+            outgoing[owner].append(record)
+      flush()
+  except Exception as error:
+    # e.g. a benchmark budget; the coordinator re-raises it
+    results.put(("error", error))
+
+def hda_star_agent(root, env, workers=None, poll_every=16, probe_interval=0.005):
+  # termination uses the four-counter method: two consecutive probe waves in
+  # which every worker is idle and the sent/received batch totals agree
+  workers = workers or multiprocessing.cpu_count()
+  inboxes = [multiprocessing.Queue() for _ in range(workers)]
+  results = multiprocessing.Queue()
+  processes = [
+    multiprocessing.Process(target=hda_star_worker, args=(index, workers, env, inboxes, results, poll_every), daemon=True)
+    for index in range(workers)
+  ]
+  for process in processes:
+    process.start()
+
+  def broadcast(message):
+    for inbox in inboxes:
+      inbox.put(message)
+
+  def next_result():
+    while True:
+      try:
+        message = results.get(timeout=1)
+      except queue.Empty:
+        if any(not process.is_alive() for process in processes):
+          raise RuntimeError("an HDA* worker exited unexpectedly")
+        continue
+      if message[0] == "error":
+        raise message[1]
+      return message
+
+  try:
+    estimate = env.heuristic(root)
+    root_record = (estimate, 0, root.state, None, root.action, root.cost)
+    inboxes[state_owner(state_key(root.state), workers)].put(("work", [root_record]))
+    (best, goal_reference) = (math.inf, None)
+    probe = 0
+    replies = {}
+    previous = None
+    broadcast(("probe", probe))
+    while True:
+      message = next_result()
+      if message[0] == "goal":
+        if message[1] < best:
+          (best, goal_reference) = (message[1], message[2])
+          broadcast(("incumbent", best))
+        continue
+      if message[0] != "probe" or message[1] != probe:
+        continue
+      replies[message[2]] = message[3:]
+      if len(replies) < workers:
+        continue
+      idle = all(reply[0] for reply in replies.values())
+      # the root batch was sent by this process
+      totals = (1 + sum(reply[1] for reply in replies.values()), sum(reply[2] for reply in replies.values()))
+      if idle and totals[0] == totals[1] and totals == previous:
+        break
+      previous = totals if idle and totals[0] == totals[1] else None
+      replies = {}
+      probe += 1
+      time.sleep(probe_interval)
+      broadcast(("probe", probe))
+    env.nodes_expanded += sum(reply[3] for reply in replies.values())
+    # an upper bound: the workers' peaks need not coincide
+    env.record_frontier(sum(reply[4] for reply in replies.values()))
+    if goal_reference is None:
+      return None
+    steps = []
+    while goal_reference is not None:
+      inboxes[goal_reference[0]].put(("trace", goal_reference[1]))
+      message = next_result()
+      while message[0] != "trace":
+        message = next_result()
+      (_, state, action, cost, goal_reference) = message
+      steps.append((state, action, cost))
+    node = None
+    for (state, action, cost) in reversed(steps):
+      node = Node(state, action, cost, node)
+    return node
+  finally:
+    broadcast(("stop",))
+    for process in processes:
+      process.join(timeout=1)
+      if process.is_alive():
+        process.kill()
+        process.join()
+
 def main():
   env = IncrementalNQueensEnvironment() # change this line to switch environments
   root = Node(env.init_state(), None, 0, None)
   agent = a_star_agent # change this line to switch agent functions
-  goal = agent(root, env)
+  portfolio = None # change this line to a list of agents to race them instead
+  if portfolio:
+    (goal, reports) = run_portfolio(root, env, portfolio)
+    for report in reports:
+      print("RACE  :", report)
+    winners = [report for report in reports if report["status"] == "winner"]
+    if not winners:
+      print("RACE  : no winner")
+      return
+    (agent_label, nodes_expanded) = (winners[0]["agent"], winners[0]["nodes_expanded"])
+  else:
+    goal = agent(root, env)
+    (agent_label, nodes_expanded) = (agent.__name__, env.nodes_expanded)
   path = goal.full_path()
   print("ENV   :", env.__class__.__name__)
-  print("AGENT :", agent.__name__)
+  print("AGENT :", agent_label)
   print("PATH  :", [(node.action, node.cost) for node in path])
   print("COST  :", sum([node.cost for node in path]))
-  print("NODES :", env.nodes_expanded)
+  print("NODES :", nodes_expanded)
 
 
 if __name__ == "__main__":
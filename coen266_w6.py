@@ -1,3 +1,22 @@
+import heapq
+import itertools
+import math
+import multiprocessing
+import multiprocessing.shared_memory
+import time
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+try:
+  import scipy.sparse
+  import scipy.sparse.linalg
+except ImportError:
+  scipy = None
+
+
 class OverheatingCarMDP:
   state_set = ["cool", "warm", "overheated"]
 
@@ -114,13 +133,81 @@ class DoubleBanditsMDP:
     return ["red", "blue"]
 
 
-def find_value_function(mdp, num_iterations):
+class GridworldMDP:
+  # cells are (x, y); "exit" from a terminal cell pays its reward and leads to
+  # "exited"; a move goes the intended way with probability 1 - noise and
+  # slips to either side otherwise, staying put when it would leave the grid
+  moves = {"north": (0, 1), "south": (0, -1), "east": (1, 0), "west": (-1, 0)}
+  sides = {"north": ("east", "west"), "south": ("east", "west"), "east": ("north", "south"), "west": ("north", "south")}
+
+  def __init__(self, width=4, height=3, terminals=None, noise=0.2, living_reward=0.0):
+    self.width = width
+    self.height = height
+    if terminals is None:
+      terminals = {(width - 1, height - 1): 1, (width - 1, height - 2): -1}
+    self.terminals = terminals
+    self.noise = noise
+    self.living_reward = living_reward
+    self.state_set = [(x, y) for y in range(height) for x in range(width)] + ["exited"]
+    self.cached_outcomes = (None, None, {})
+
+  def outcomes(self, state, action):
+    (cached_state, cached_action, distribution) = self.cached_outcomes
+    if cached_state == state and cached_action == action:
+      return distribution
+    distribution = {}
+    if action == "exit":
+      distribution["exited"] = 1
+    elif action in self.moves:
+      for (direction, p) in [(action, 1 - self.noise)] + [(side, self.noise / 2) for side in self.sides[action]]:
+        if p:
+          (dx, dy) = self.moves[direction]
+          (x, y) = (state[0] + dx, state[1] + dy)
+          landing = (x, y) if 0 <= x < self.width and 0 <= y < self.height else state
+          distribution[landing] = distribution.get(landing, 0) + p
+    self.cached_outcomes = (state, action, distribution)
+    return distribution
+
+  def reward(self, state, action, state_prime):
+    if action == "exit":
+      return self.terminals[state]
+    return self.living_reward
+
+  def transition_prob(self, state, action, state_prime):
+    return self.outcomes(state, action).get(state_prime, 0)
+
+  def successor_states(self, state, action):
+    return list(self.outcomes(state, action))
+
+  def possible_actions(self, state):
+    if state == "exited":
+      return []
+    if state in self.terminals:
+      return ["exit"]
+    return ["north", "south", "east", "west"]
+
+
+def convergence_threshold(discount_factor, tolerance):
+  # a Bellman residual below tolerance * (1 - gamma) / gamma leaves every value
+  # within tolerance of the fixed point
+  if tolerance is None:
+    return -1
+  if discount_factor == 0:
+    return math.inf
+  return tolerance * (1 - discount_factor) / discount_factor
+
+
+def find_value_function(mdp, num_iterations, tolerance=None, in_place=False, stats=None):
   V = {} # Value Dictionary
   for state in mdp.state_set:
     V[state] = 0
-    
+
+  threshold = convergence_threshold(mdp.discount_factor, tolerance)
+  sweeps = 0
+  residual = math.inf
   for _ in range(num_iterations):
-    V_prime = V.copy()
+    V_prime = V if in_place else V.copy() # in place is Gauss-Seidel: later states see this sweep's values
+    residual = 0
         
     for state in mdp.state_set:
       if not mdp.possible_actions(state):
@@ -136,10 +223,71 @@ def find_value_function(mdp, num_iterations):
                 
         action_values.append(Q)
             
+      residual = max(residual, abs(max(action_values) - V_prime[state]))
       V_prime[state] = max(action_values)
         
     V = V_prime
+    sweeps += 1
+    if residual <= threshold:
+      break
+
+  if stats is not None:
+    stats.update(sweeps=sweeps, residual=residual)
+  return V
+
+
+def prioritized_sweeping(mdp, tolerance=1e-6, max_backups=None, stats=None):
+  # asynchronous value iteration: always back up the state with the largest
+  # bound on its Bellman error; a change of delta at s' raises each
+  # predecessor's bound by gamma * max_a T(p, a, s') * delta. Once no bound
+  # exceeds tolerance * (1 - gamma), every value is within tolerance of V*
+  gamma = mdp.discount_factor
+  model = {} # state -> one list of (state', p, r) per action
+  predecessors = {state: {} for state in mdp.state_set} # state' -> {state: max_a T(state, a, state')}
+  for state in mdp.state_set:
+    model[state] = []
+    for action in mdp.possible_actions(state):
+      outcomes = []
+      for state_prime in mdp.successor_states(state, action):
+        p = mdp.transition_prob(state, action, state_prime)
+        if p:
+          outcomes.append((state_prime, p, mdp.reward(state, action, state_prime)))
+          weights = predecessors[state_prime]
+          weights[state] = max(weights.get(state, 0), p)
+      model[state].append(outcomes)
+
+  V = {state: 0 for state in mdp.state_set}
+  bounds = {state: 0 for state in mdp.state_set}
+  threshold = tolerance * (1 - gamma)
+  frontier = []
+  counter = itertools.count()
+  backups = 0
+
+  def backup(state):
+    nonlocal backups
+    backups += 1
+    bounds[state] = 0
+    value = max(sum(p * (r + gamma * V[state_prime]) for (state_prime, p, r) in outcomes)
+                for outcomes in model[state])
+    delta = abs(value - V[state])
+    V[state] = value
+    for (predecessor, weight) in predecessors[state].items():
+      if model[predecessor] and delta:
+        bounds[predecessor] += gamma * weight * delta
+        if bounds[predecessor] > threshold:
+          heapq.heappush(frontier, (-bounds[predecessor], next(counter), predecessor))
 
+  # one in-place sweep sets every bound, after which only changing states are touched
+  for state in mdp.state_set:
+    if model[state]:
+      backup(state)
+  while frontier and (max_backups is None or backups < max_backups):
+    (negative_bound, _, state) = heapq.heappop(frontier)
+    if -negative_bound == bounds[state]:
+      backup(state)
+
+  if stats is not None:
+    stats.update(backups=backups, residual_bound=max(bounds.values(), default=0))
   return V
 
 
@@ -166,11 +314,277 @@ def extract_policy(mdp, value_function):
   return policy
 
 
-mdp = SimpleLeftRightMDP() # change this line to change which MDP you're solving
-mdp.discount_factor = 0 # change this line to change the discount factor (gamma)
-num_iterations = 10 # change this line to change how many iterations of the Bellman update you perform
-value_function = find_value_function(mdp, num_iterations)
-policy = extract_policy(mdp, value_function)
-print("MDP    :", mdp.__class__.__name__)
-print("VALUE  :", value_function)
-print("POLICY :", policy)
+class CompiledMDP:
+  # pair p is (states[pair_states[p]], pair_actions[p]); its transitions are
+  # slots offsets[p]:offsets[p + 1] of successors/probabilities, and
+  # expected_rewards[p] sums T(s, a, s') * R(s, a, s') over them
+  def __init__(self, states, pair_states, pair_actions, offsets, successors, probabilities, expected_rewards, discount_factor):
+    self.states = states
+    self.index = {state: i for (i, state) in enumerate(states)}
+    self.pair_states = np.asarray(pair_states, dtype=np.int64)
+    self.pair_actions = pair_actions
+    self.offsets = np.asarray(offsets, dtype=np.int64)
+    self.successors = np.asarray(successors, dtype=np.int64)
+    self.probabilities = np.asarray(probabilities, dtype=np.float64)
+    self.expected_rewards = np.asarray(expected_rewards, dtype=np.float64)
+    self.discount_factor = discount_factor
+    self.slot_pairs = np.repeat(np.arange(len(pair_actions)), np.diff(self.offsets))
+    # pairs are grouped by state, so each acting state owns one contiguous run
+    (self.acting_states, self.first_pairs) = np.unique(self.pair_states, return_index=True)
+
+  def q_values(self, values):
+    weighted = np.bincount(self.slot_pairs, weights=self.probabilities * values[self.successors],
+                           minlength=len(self.pair_actions))
+    return self.expected_rewards + self.discount_factor * weighted
+
+  def backup(self, values):
+    # states without actions keep a value of 0, as in find_value_function
+    new_values = np.zeros(len(self.states))
+    if len(self.pair_actions):
+      new_values[self.acting_states] = np.maximum.reduceat(self.q_values(values), self.first_pairs)
+    return new_values
+
+  def greedy_pairs(self, values, current=None):
+    # the first best pair of every acting state; with current given, a state
+    # keeps its current pair unless another one is strictly better
+    q = self.q_values(values)
+    best_q = np.maximum.reduceat(q, self.first_pairs)
+    counts = np.diff(np.append(self.first_pairs, len(q)))
+    candidates = np.where(q == np.repeat(best_q, counts), np.arange(len(q)), len(q))
+    pairs = np.minimum.reduceat(candidates, self.first_pairs)
+    if current is not None:
+      improved = q[pairs] > q[current] + 1e-12 * (1 + np.abs(q[current]))
+      pairs = np.where(improved, pairs, current)
+    return pairs
+
+  def policy_transitions(self, pairs):
+    # rows, columns and probabilities of the transition matrix when each
+    # acting state takes its pair in pairs
+    starts = self.offsets[pairs]
+    lengths = self.offsets[pairs + 1] - starts
+    rows = np.repeat(self.acting_states, lengths)
+    slots = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return (rows, self.successors[slots], self.probabilities[slots])
+
+  def value_dict(self, values):
+    return {state: float(value) for (state, value) in zip(self.states, values)}
+
+  def policy_dict(self, values, pairs=None):
+    if pairs is None:
+      pairs = self.greedy_pairs(values) if len(self.pair_actions) else []
+    policy = dict.fromkeys(self.states)
+    for (state, pair) in zip(self.acting_states.tolist(), list(pairs)):
+      policy[self.states[state]] = self.pair_actions[pair]
+    return policy
+
+
+def compile_mdp(mdp):
+  if np is None:
+    raise ImportError("compile_mdp requires NumPy")
+  states = list(mdp.state_set)
+  index = {state: i for (i, state) in enumerate(states)}
+  pair_states = []
+  pair_actions = []
+  offsets = [0]
+  successors = []
+  probabilities = []
+  expected_rewards = []
+  for (i, state) in enumerate(states):
+    for action in mdp.possible_actions(state):
+      expected = 0
+      for state_prime in mdp.successor_states(state, action):
+        p = mdp.transition_prob(state, action, state_prime)
+        if p:
+          successors.append(index[state_prime])
+          probabilities.append(p)
+          expected += p * mdp.reward(state, action, state_prime)
+      pair_states.append(i)
+      pair_actions.append(action)
+      offsets.append(len(successors))
+      expected_rewards.append(expected)
+  return CompiledMDP(states, pair_states, pair_actions, offsets, successors, probabilities, expected_rewards,
+                     mdp.discount_factor)
+
+
+def find_value_function_compiled(mdp, num_iterations, tolerance=None, stats=None):
+  compiled = mdp if isinstance(mdp, CompiledMDP) else compile_mdp(mdp)
+  threshold = convergence_threshold(compiled.discount_factor, tolerance)
+  values = np.zeros(len(compiled.states))
+  sweeps = 0
+  residual = math.inf
+  for _ in range(num_iterations):
+    new_values = compiled.backup(values)
+    residual = float(np.abs(new_values - values).max()) if len(values) else 0.0
+    values = new_values
+    sweeps += 1
+    if residual <= threshold:
+      break
+  if stats is not None:
+    stats.update(sweeps=sweeps, residual=residual)
+  return compiled.value_dict(values)
+
+
+def extract_policy_compiled(mdp, value_function):
+  compiled = mdp if isinstance(mdp, CompiledMDP) else compile_mdp(mdp)
+  values = np.array([value_function[state] for state in compiled.states], dtype=np.float64)
+  return compiled.policy_dict(values)
+
+
+def evaluate_policy(compiled, pairs, values, sweeps=None, tolerance=1e-10):
+  # exact evaluation solves (I - gamma P) V = r with scipy's sparse solver,
+  # falling back to repeated backups; sweeps=k applies k backups instead
+  n = len(compiled.states)
+  (rows, columns, probabilities) = compiled.policy_transitions(pairs)
+  rewards = np.zeros(n)
+  rewards[compiled.acting_states] = compiled.expected_rewards[pairs]
+  gamma = compiled.discount_factor
+  if sweeps is None and scipy is not None:
+    transitions = scipy.sparse.csr_matrix((probabilities, (rows, columns)), shape=(n, n))
+    system = (scipy.sparse.identity(n, format="csr") - gamma * transitions).tocsc()
+    return scipy.sparse.linalg.spsolve(system, rewards)
+  threshold = convergence_threshold(gamma, tolerance)
+  iteration = 0
+  while sweeps is None or iteration < sweeps:
+    new_values = rewards + gamma * np.bincount(rows, weights=probabilities * values[columns], minlength=n)
+    residual = float(np.abs(new_values - values).max()) if n else 0.0
+    values = new_values
+    iteration += 1
+    if sweeps is None and residual <= threshold:
+      break
+  return values
+
+
+def policy_iteration(mdp, max_iterations=1000, evaluation_sweeps=None, tolerance=1e-6, stats=None):
+  # evaluation_sweeps=None evaluates every policy exactly and stops when the
+  # policy is stable; a number k gives modified policy iteration, which
+  # stops on the same Bellman-residual test as find_value_function
+  compiled = mdp if isinstance(mdp, CompiledMDP) else compile_mdp(mdp)
+  values = np.zeros(len(compiled.states))
+  if not len(compiled.pair_actions):
+    return (compiled.value_dict(values), compiled.policy_dict(values, []))
+  pairs = compiled.greedy_pairs(values)
+  threshold = convergence_threshold(compiled.discount_factor, tolerance)
+  iterations = 0
+  for _ in range(max_iterations):
+    values = evaluate_policy(compiled, pairs, values, evaluation_sweeps)
+    iterations += 1
+    new_pairs = compiled.greedy_pairs(values, pairs)
+    if evaluation_sweeps is None:
+      converged = np.array_equal(new_pairs, pairs)
+    else:
+      converged = float(np.abs(compiled.backup(values) - values).max()) <= threshold
+    # the returned policy is always the greedy one for the returned values
+    pairs = new_pairs
+    if converged:
+      break
+  if stats is not None:
+    stats.update(iterations=iterations)
+  return (compiled.value_dict(values), compiled.policy_dict(values, pairs))
+
+
+def partition_states(compiled, workers):
+  # contiguous blocks of states holding about the same number of transitions
+  state_pairs = np.searchsorted(compiled.pair_states, np.arange(len(compiled.states) + 1))
+  state_slots = compiled.offsets[state_pairs]
+  targets = np.linspace(0, state_slots[-1], workers + 1)
+  bounds = np.searchsorted(state_slots, targets)
+  bounds[0] = 0
+  bounds[-1] = len(compiled.states)
+  return bounds.tolist()
+
+
+def parallel_sweep_worker(compiled, index, workers, first_state, last_state, names, barrier, num_iterations, threshold):
+  # sweep k reads values[k % 2] and writes values[(k + 1) % 2]; residuals are
+  # double-buffered the same way, so one barrier per sweep is enough and
+  # every worker reaches the same stopping decision
+  blocks = [multiprocessing.shared_memory.SharedMemory(name=name) for name in names]
+  n = len(compiled.states)
+  buffers = [np.ndarray((n,), dtype=np.float64, buffer=blocks[i].buf) for i in (0, 1)]
+  residuals = np.ndarray((2, workers), dtype=np.float64, buffer=blocks[2].buf)
+  control = np.ndarray((2,), dtype=np.float64, buffer=blocks[3].buf)
+  try:
+    (first_pair, last_pair) = np.searchsorted(compiled.pair_states, [first_state, last_state])
+    (first_slot, last_slot) = (compiled.offsets[first_pair], compiled.offsets[last_pair])
+    successors = compiled.successors[first_slot:last_slot]
+    probabilities = compiled.probabilities[first_slot:last_slot]
+    slot_pairs = compiled.slot_pairs[first_slot:last_slot] - first_pair
+    rewards = compiled.expected_rewards[first_pair:last_pair]
+    (acting, first_pairs) = np.unique(compiled.pair_states[first_pair:last_pair], return_index=True)
+    acting = acting - first_state
+    sweeps = 0
+    for sweep in range(num_iterations):
+      current = buffers[sweep % 2]
+      new_values = np.zeros(last_state - first_state)
+      if last_pair > first_pair:
+        q = rewards + compiled.discount_factor * np.bincount(
+          slot_pairs, weights=probabilities * current[successors], minlength=last_pair - first_pair)
+        new_values[acting] = np.maximum.reduceat(q, first_pairs)
+      residual = np.abs(new_values - current[first_state:last_state]).max() if len(new_values) else 0.0
+      buffers[(sweep + 1) % 2][first_state:last_state] = new_values
+      residuals[(sweep + 1) % 2, index] = residual
+      barrier.wait()
+      sweeps = sweep + 1
+      if residuals[sweeps % 2].max() <= threshold:
+        break
+    if index == 0:
+      control[0] = sweeps
+      control[1] = residuals[sweeps % 2].max() if sweeps else math.inf
+  finally:
+    del buffers, residuals, control
+    for block in blocks:
+      block.close()
+
+
+def find_value_function_parallel(mdp, num_iterations, workers=None, tolerance=None, stats=None):
+  compiled = mdp if isinstance(mdp, CompiledMDP) else compile_mdp(mdp)
+  n = len(compiled.states)
+  workers = max(1, min(workers or multiprocessing.cpu_count(), n))
+  sizes = [8 * n, 8 * n, 16 * workers, 16]
+  blocks = [multiprocessing.shared_memory.SharedMemory(create=True, size=max(1, size)) for size in sizes]
+  try:
+    for block in blocks:
+      block.buf[:] = bytes(len(block.buf))
+    barrier = multiprocessing.Barrier(workers)
+    bounds = partition_states(compiled, workers)
+    threshold = convergence_threshold(compiled.discount_factor, tolerance)
+    names = [block.name for block in blocks]
+    processes = [
+      multiprocessing.Process(target=parallel_sweep_worker, daemon=True, args=(
+        compiled, index, workers, bounds[index], bounds[index + 1], names, barrier, num_iterations, threshold))
+      for index in range(workers)
+    ]
+    for process in processes:
+      process.start()
+    while any(process.is_alive() for process in processes):
+      if any(process.exitcode not in (None, 0) for process in processes):
+        # release the others from the barrier
+        barrier.abort()
+      time.sleep(0.01)
+    if any(process.exitcode != 0 for process in processes):
+      raise RuntimeError("a value iteration worker failed")
+    control = np.ndarray((2,), dtype=np.float64, buffer=blocks[3].buf)
+    (sweeps, residual) = (int(control[0]), float(control[1]))
+    del control
+    values = np.ndarray((n,), dtype=np.float64, buffer=blocks[sweeps % 2].buf).copy()
+  finally:
+    for block in blocks:
+      block.close()
+      block.unlink()
+  if stats is not None:
+    stats.update(sweeps=sweeps, residual=residual, workers=workers)
+  return compiled.value_dict(values)
+
+
+def main():
+  mdp = SimpleLeftRightMDP() # change this line to change which MDP you're solving
+  mdp.discount_factor = 0 # change this line to change the discount factor (gamma)
+  num_iterations = 10 # change this line to change how many iterations of the Bellman update you perform
+  value_function = find_value_function(mdp, num_iterations)
+  policy = extract_policy(mdp, value_function)
+  print("MDP    :", mdp.__class__.__name__)
+  print("VALUE  :", value_function)
+  print("POLICY :", policy)
+
+
+if __name__ == "__main__":
+  main()